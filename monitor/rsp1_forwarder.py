@@ -5,156 +5,246 @@ This is a helper script for forwarding sdrplay's rsp_tcp raw sample(dongle info
 Note:
 1. While the sdrplay receiver model for this script is RSP1, other models should be easily adapted.
 2. When run rsp_tcp, RSP extended mode must be enabled(use command 'rsp_tcp -E' to run).
+3. If rsp_tcp runs on another host, the "incoming cpu" logged at startup tells which core handles the NIC
+   receive queue; keep csdr/wsjtx away from that core(taskset) or move the NIC irq(/proc/irq/N/smp_affinity).
 """
-from struct import pack, unpack
-from time import sleep
+from struct import Struct
 import socket
 import sys
-import getopt
-from threading import Thread
-from queue import Queue
-
-MAX_DATA_BUFF = 1024000
-job_done = False #pylint: disable=C0103
+import os
+import stat
+import errno
+import argparse
+import signal
+import select
+try:
+    import fcntl
+except ImportError:     #not on windows
+    fcntl = None
+
+RECV_BUFF_SIZE = 65536      #bytes per recv_into, take whatever the kernel has buffered
+RECV_LOWAT = 16384          #don't wake the forwarder up until this many bytes are queued(~7ms of samples)
+SOCK_RCVBUF_SIZE = 8 << 20  #kernel socket receive buffer, absorbs sample bursts
+SOCK_BUSY_POLL_US = 50      #linux NAPI busy polling on recv, needs CAP_NET_ADMIN, ignored otherwise
+DEBUG = bool(os.environ.get('RSP1_DEBUG'))    #set RSP1_DEBUG=1 to also dump raw command bytes
+SO_BUSY_POLL = getattr(socket, 'SO_BUSY_POLL', 46) #not exported by python socket module, value from linux socket.h
+CONNECT_TIMEOUT = 5         #seconds to wait for rsp_tcp to accept
+SPLICE_SIZE = 1 << 20       #max bytes moved per splice call
+PIPE_SIZE = 1 << 20         #stdout pipe capacity(~0.4s of samples), linux default 64KiB fills in ~25ms
+
+#rtl dongle info(12 bytes) followed by rsp extended capabilities info(45 bytes, 4 of them reserved)
+DEVICE_INFO = Struct('!4sII4sII4xIIB13siBBB')
+#rtl_tcp style control command: 1 byte command id + 4 bytes parameter
+COMMAND = Struct('>ci')
 
 def log(msg) -> None:
     print(msg, file=sys.stderr)
 
 
-def write_to_stdout(dataq: Queue) -> None:
-    while not job_done:
-        data = dataq.get()
-        sys.stdout.buffer.write(data)
-    log("job done and exit thread...")
+def hexdump(data: bytes) -> str:
+    """Raw bytes for log lines, only rendered in DEBUG mode."""
+    return f"({data.hex(' ')})" if DEBUG else ''
+
+
+def recv_exact(sock: socket.socket, size: int) -> bytearray:
+    """Receive exactly size bytes from sock."""
+    buf = bytearray(size)
+    view = memoryview(buf)
+    got = 0
+    while got < size:
+        n = sock.recv_into(view[got:])
+        if n == 0:
+            raise ConnectionError(f"Connection closed after {got} of {size} bytes.")
+        got += n
+    return buf
+
+def connect(sock: socket.socket, address: tuple, timeout: float) -> None:
+    """Nonblocking connect to address, wait at most timeout seconds for it to complete. Leave sock in blocking mode."""
+    sock.setblocking(False)
+    err = sock.connect_ex(address)
+    if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+        raise OSError(err, os.strerror(err))
+    if err != 0:
+        _, writable, _ = select.select([], [sock], [], timeout)
+        if not writable:
+            raise TimeoutError(f"Timeout when connect to {address[0]}:{address[1]}")
+        err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err != 0:
+            raise OSError(err, os.strerror(err))
+    sock.setblocking(True)
+
+def enlarge_pipe(fd: int, size: int) -> None:
+    """If fd is a pipe, grow its kernel buffer to size bytes, so a slow reader doesn't stall forwarding at once."""
+    if fcntl is None or not hasattr(fcntl, 'F_SETPIPE_SZ') or not stat.S_ISFIFO(os.fstat(fd).st_mode):
+        return
+    try:
+        fcntl.fcntl(fd, fcntl.F_SETPIPE_SZ, size)
+    except OSError as err:
+        log(f"Warning: can not set stdout pipe size to {size}(see /proc/sys/fs/pipe-max-size): {err}")
+
+def splice_to(sock: socket.socket, out_fd: int) -> bool:
+    """Move sample stream from sock to out_fd inside the kernel with splice(2), samples never enter user space.
+    Return False if splice is not usable here(non-linux, or out_fd is a tty etc.), True when stream reaches EOF.
+    """
+    mode = os.fstat(out_fd).st_mode
+    if not hasattr(os, 'splice') or not (stat.S_ISFIFO(mode) or stat.S_ISREG(mode)):
+        return False
+    in_fd = sock.fileno()
+    pipe_r, pipe_w = None, out_fd
+    if not stat.S_ISFIFO(mode):
+        #splice(2) refuses to write a file opened with O_APPEND(shell '>>')
+        if fcntl is not None and fcntl.fcntl(out_fd, fcntl.F_GETFL) & os.O_APPEND:
+            return False
+        #splice needs a pipe at one end, bounce through a private one
+        pipe_r, pipe_w = os.pipe()
+    try:
+        first, first_out = True, True
+        while True:
+            try:
+                n = os.splice(in_fd, pipe_w, SPLICE_SIZE, flags=os.SPLICE_F_MOVE)
+            except OSError as err:
+                if first and err.errno in (errno.EINVAL, errno.ENOSYS):
+                    return False
+                raise
+            first = False
+            if n == 0:
+                return True
+            while pipe_r is not None and n > 0:
+                try:
+                    n -= os.splice(pipe_r, out_fd, n, flags=os.SPLICE_F_MOVE)
+                except OSError as err:
+                    if first_out and err.errno in (errno.EINVAL, errno.ENOSYS):
+                        #the file can't be spliced to, write out what is in the pipe and fall back
+                        while n > 0:
+                            data = os.read(pipe_r, n)
+                            n -= len(data)
+                            while data:
+                                data = data[os.write(out_fd, data):]
+                        return False
+                    raise
+                first_out = False
+    finally:
+        if pipe_r is not None:
+            os.close(pipe_r)
+            os.close(pipe_w)
+
+arg_parser = argparse.ArgumentParser(description='RSP1 tcp stream forwarder, print sample data to stdout.')
+arg_parser.add_argument('-a', '--address', default='127.0.0.1', help='rsp_tcp server listen address')
+arg_parser.add_argument('-p', '--port', type=int, default=1234, help='rsp_tcp server listen port')
+arg_parser.add_argument('-f', '--freq', type=int, default=50400000, help='frequency_to_tune_to [Hz]')
+arg_parser.add_argument('-s', '--samplerate', type=int, default=1200000, help='samplerate')
+
+def setup_rsp_tcp(sock: socket.socket, freq: int, samplerate: int) -> None:
+    """Drop dongle & extended capabilities info from a connected rsp_tcp stream, then tune it.
+    Sample bytes are all that is left in sock when this returns.
+    """
+    #rsp_tcp sends rtl dongle info and rsp extended_capabilities info right after accept, before any sample bytes.
+    #Read(and drop) them first, both in one go: once they are here the server is up and serving us,
+    #so the control commands can follow without any settle time.
+    (dongle, tuner_type, tuner_gain_count,
+     magic, version, capabilities, hardware_version, sample_format, antenna_input_count,
+     third_antenna_name, third_antenna_freq_limit, tuner_count, ifgr_min, ifgr_max) = DEVICE_INFO.unpack(recv_exact(sock, DEVICE_INFO.size))
+    third_antenna_name = third_antenna_name.rstrip(b"\x00").decode("ascii")
+    log(f"""Got some dongle info from rsp device:
+    dongle: {dongle.decode("ascii")}
+    tuner_type: {tuner_type}
+    tuner_gain_count: {tuner_gain_count}
+""")
 
-def usage():
-    print("""RSP1 tcp stream forwarder, print sample data to stdout.
-            -h, --help                  Print this message
-            -a, --address=127.0.0.1     rsp_tcp server listen address
-            -p, --port=1234             rsp_tcp server listen port
-            -f, --freq=50400000         frequency_to_tune_to [Hz]
-            -s, --samplerate=1200000    samplerate
-        """)
+    log(f"""Got some extended capabilities info from rsp device:
+    magic: {magic.decode("ascii")}
+    version: {version}
+    capabilities: {capabilities}
+    hardware_version: {hardware_version}
+    sample_format: {sample_format}
+    antenna_input_count: {antenna_input_count}
+    third_antenna_name: {third_antenna_name}
+    third_antenna_freq_limit: {third_antenna_freq_limit}
+    tuner_count: {tuner_count}
+    ifgr_min: {ifgr_min}
+    ifgr_max: {ifgr_max}
+""")
 
-def main() -> None:
-    tq = Queue(MAX_DATA_BUFF)
+    #All control commands go out in one send, TCP keeps them in order.
+    freqb = COMMAND.pack(b"\x01", freq)
+    log(f"Setting center frequency to: {freq}{hexdump(freqb)}.")
+    rateb = COMMAND.pack(b"\x02", samplerate)
+    log(f"Setting sample rate to: {samplerate}{hexdump(rateb)}.")
+    tuner_gain_mode_enable = COMMAND.pack(b"\x03", 0)
+    log("Enabling AGC")
+    #RPS1 gain within 0~491
+    gain = COMMAND.pack(b"\x04", 300)
+    log("Setting gain to 300.")
+    #LNA GR (dB) by Frequency Range and LNAstate for RSP1: 0:0db, 1-24db, 2-19db, 3-43db
+    LNA_state = COMMAND.pack(b"\x20", 3)
+    log("Setting LNA State to 3.")
+    sock.sendall(b"".join((freqb, rateb, tuner_gain_mode_enable, gain, LNA_state)))
+
+def run_forwarder(sock: socket.socket, out_fd: int) -> None:
+    """Forward sample stream from sock to file descriptor out_fd until EOF."""
+    #Each blocking recv/splice then returns a batch of samples instead of entering the kernel per tcp segment.
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVLOWAT, RECV_LOWAT)
+    enlarge_pipe(out_fd, PIPE_SIZE)
+    if splice_to(sock, out_fd):
+        return
+
+    log('splice not available, forwarding sample stream through user space.')
+    buf = memoryview(bytearray(RECV_BUFF_SIZE))
+    #steady state hot loop, keep per chunk interpreter work to the bare minimum.
+    #os.write straight to the fd, BufferedWriter would only add a lock and a copy per chunk.
+    recv_into, write = sock.recv_into, os.write
+    while (n := recv_into(buf)):
+        #full buffer is the common case under load, write it without making a slice view
+        written = write(out_fd, buf if n == RECV_BUFF_SIZE else buf[:n])
+        while written < n:
+            written += write(out_fd, buf[written:n])
 
-    try:
-        opts, _ = getopt.getopt(sys.argv[1:], "ha:p:f:s:", ["help", "address=", "port=", "freq=", "samplerate="])
-    except getopt.GetoptError as err:
-        print(err)
-        usage()
-        sys.exit(2)
-
-    addr = '127.0.0.1'
-    port = 1234
-    freq = 50400000
-    samplerate = 1200000
-    for o, a in opts:
-        if o in ("-h", "--help"):
-            usage()
-            sys.exit()
-        elif o in ("-a", "--address"):
-            addr = a
-        elif o in ("-p", "--port"):
-            port = int(a)
-        elif o in ("-f", "--freq"):
-            freq = int(a)
-        elif o in ("-s", "--samplerate"):
-            samplerate = int(a)
-        else:
-            assert False, "unhandled option!"
+def main() -> None:
+    args = arg_parser.parse_args()
+    addr, port, freq, samplerate = args.address, args.port, args.freq, args.samplerate
 
     try:
-        ts = Thread(target=write_to_stdout, args=(tq,))
-        ts.start()
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.settimeout(5)
-            connected = False
-            while not connected:
-                sock.connect((addr, port))
-                connected = True
-
-            sock.settimeout(None)
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCK_RCVBUF_SIZE)
+            except OSError as err:  #macOS/BSD refuse sizes above kern.ipc.maxsockbuf, linux clamps silently
+                log(f"Socket receive buffer left at default: {err}")
+            #control commands are tiny, don't let nagle hold them back
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if sys.platform.startswith('linux'):
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, SO_BUSY_POLL, SOCK_BUSY_POLL_US)
+                except OSError as err:
+                    log(f"Busy polling not enabled: {err}")
+            connect(sock, (addr, port), CONNECT_TIMEOUT)
             log(f"Connection made with rsp_tcp server at {addr}:{port}.")
+            if hasattr(socket, 'SO_INCOMING_CPU'):
+                log(f"Incoming cpu: {sock.getsockopt(socket.SOL_SOCKET, socket.SO_INCOMING_CPU)}")
 
-            freqb = pack(">ci", b"\x01", freq)
-            freqs = ' '.join('{:02x}'.format(x) for x in freqb)
-            log(f"Setting center frequency to: {freq}({freqs}).")
-            sock.sendall(freqb)
-            sleep(2)
-
-            rateb = pack("!ci", b"\x02", samplerate)
-            rates = ' '.join('{:02x}'.format(x) for x in rateb)
-            log(f"Setting sample rate to: {samplerate} ({rates})")
-            sock.sendall(rateb)
-            sleep(2)
-
-            tuner_gain_mode_enable = pack(">ci", b"\x03", 0)
-            log("Enabling AGC")
-            sock.sendall(tuner_gain_mode_enable)
-            sleep(2)
-
-            #RPS1 gain within 0~491
-            LNA_state = pack(">ci", b"\x04", 300)
-            log("Setting gain to 300.")
-            sock.sendall(LNA_state)
-            sleep(2)
-
-            #LNA GR (dB) by Frequency Range and LNAstate for RSP1: 0:0db, 1-24db, 2-19db, 3-43db
-            LNA_state = pack(">ci", b"\x20", 3)
-            log("Setting LNA State to 3.")
-            sock.sendall(LNA_state)
-            sleep(2)
-
-            #Now we start recv bytes from rsp_tcp.
-            #Just before sample bytes,let's drop some message from stream.
-            #First: rtl dongle info
-            dongle_info = unpack('!cccc', sock.recv(4))
-            tuner_type = unpack('!I', sock.recv(4))
-            tuner_gain_count = unpack('!I', sock.recv(4))
-            log(f"""Got some dongle info from rsp device:
-    dongle: {b"".join(dongle_info).decode("ascii")}
-    tuner_type: {tuner_type[0]}
-    tuner_gain_count: {tuner_gain_count[0]}
-""")
+            setup_rsp_tcp(sock, freq, samplerate)
 
-            #Then: rsp extended_capabilities info
-            magic = unpack('!cccc', sock.recv(4))
-            version = unpack('!I', sock.recv(4))
-            capabilities = unpack('!I', sock.recv(4))
-            __reserved__ = unpack('!I', sock.recv(4))
-            hardware_version = unpack('!I', sock.recv(4))
-            sample_format = unpack('!I', sock.recv(4))
-            antenna_input_count = unpack('!B', sock.recv(1))
-            third_antenna_name = unpack('!ccccccccccccc', sock.recv(13))
-            third_antenna_freq_limit = unpack('!i', sock.recv(4))
-            tuner_count = unpack('!B', sock.recv(1))
-            ifgr_min = unpack('!B', sock.recv(1))
-            ifgr_max = unpack('!B', sock.recv(1))
-            log(f"""Got some extended capabilities info from rsp device:
-    magic: {b"".join(magic).decode("ascii")}
-    version: {version[0]}
-    capabilities: {capabilities[0]}
-    __reserved__: {__reserved__[0]}
-    hardware_version: {hardware_version[0]}
-    sample_format: {sample_format[0]}
-    antenna_input_count: {antenna_input_count[0]}
-    third_antenna_name: {b"".join(third_antenna_name).decode("ascii")}
-    third_antenna_freq_limit: {third_antenna_freq_limit[0]}
-    tuner_count: {tuner_count[0]}
-    ifgr_min: {ifgr_min[0]}
-    ifgr_max: {ifgr_max[0]}
-""")
             #Finaly, the realtime sample bytes from there...
             log('Begin forwarding sample stream...')
-            while True:
-                tq.put(sock.recv(512))
+            #On Ctrl-C/kill, shut the socket down, both forwarding paths then see a normal EOF and finish cleanly.
+            def stop(signum, _frame):
+                log(f"Caught signal {signum}, stopping...")
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:     #ENOTCONN, rsp_tcp hung up already
+                    pass
+            old_int = signal.signal(signal.SIGINT, stop)
+            old_term = signal.signal(signal.SIGTERM, stop)
+            try:
+                sys.stdout.flush()
+                run_forwarder(sock, sys.stdout.fileno())
+            finally:
+                #sock is closed after the with block, a later signal takes the default path again
+                signal.signal(signal.SIGINT, old_int)
+                signal.signal(signal.SIGTERM, old_term)
+            log('Sample stream closed.')
 
     except KeyboardInterrupt:
-        global job_done     #pylint: disable=W0603
-        job_done = True
-        ts.join()
+        log("Caught KeyboardInterrupt, exit...")
 
 
 if __name__ == '__main__' :
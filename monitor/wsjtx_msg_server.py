@@ -9,16 +9,52 @@ import re
 import time
 import getopt
 import datetime
-from socket import socket, AF_INET, SOCK_DGRAM
-from struct import pack, unpack
-from threading import Thread
-from queue import Queue, Empty
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from socket import socket, AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_RCVBUF
+try:
+    from socket import MSG_DONTWAIT
+except ImportError: #windows, see UDP_Connector.wait_datagram
+    MSG_DONTWAIT = None
+from selectors import DefaultSelector, EVENT_READ
+from struct import Struct, error as StructError
+from threading import Thread, Event
+from queue import Queue, SimpleQueue, Empty
 import http.client
 import json
 from urllib.parse import urlparse
 
+#log goes straight to stderr, until main moves the writes to a listener thread
+_log_stderr = logging.StreamHandler(sys.stderr)
+_log_stderr.setFormatter(logging.Formatter('%(message)s'))
+logger = logging.getLogger('ft8monitor')
+logger.setLevel(logging.INFO)
+logger.propagate = False
+logger.addHandler(_log_stderr)
+
 def log(msg) -> None:
-    print(msg, file=sys.stderr)
+    logger.info(msg)
+
+def start_log_listener() -> QueueListener:
+    """ From now on log records are only queued by the caller, a listener
+        thread writes them to stderr, so a slow stderr reader (pipe,
+        journald) never blocks the udp or decode loop.
+        Give the listener to stop_log_listener when done.
+    """
+    log_queue = SimpleQueue()
+    listener = QueueListener(log_queue, _log_stderr)
+    listener.start()
+    logger.removeHandler(_log_stderr)
+    logger.addHandler(QueueHandler(log_queue))
+    return listener
+
+def stop_log_listener(listener: QueueListener) -> None:
+    """ Write what is still queued and log straight to stderr again.
+    """
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(_log_stderr)
+    listener.stop()
 
 
 
@@ -45,36 +81,42 @@ class CTY:
     '''
     re_callsign = re.compile(r'(\=)?([A-Z0-9/]+)(\(\d+\))?(\[\d+\])?')
 
-    re_full_callsign = re.compile(r'^((\d|[A-Z])+\/)?([A-Z0-9]{1,3}[0-9][A-Z0-9]{0,3}[A-Z])(\/(\d|[A-Z])+)?(\/(\d|[A-Z])+)?$')
+    #no capture groups and no (\d|[A-Z]) alternation, a hand written char loop was measured slower than this in CPython
+    re_full_callsign = re.compile(r'^(?:[\dA-Z]+/)?[A-Z0-9]{1,3}[0-9][A-Z0-9]{0,3}[A-Z](?:/[\dA-Z]+){0,2}$')
     re_indicator = re.compile(r'^(\d{3})$|^([A-Z]{1,4})$')
     re_grid = re.compile(r'^[A-R][A-R]\d{2}$')
+    msg_commands = frozenset(('CQ', 'QRZ', 'DE'))
+
+    #max entries of the callsign lookup cache, it is dropped as a whole when full
+    lookup_cache_size = 8192
+
+    @staticmethod
+    def is_grid(s):
+        '''
+        Same as bool(re_grid.match(s))
+        '''
+        return len(s) == 4 and 'A' <= s[0] <= 'R' and 'A' <= s[1] <= 'R' and s[2].isdecimal() and s[3].isdecimal()
 
     def __init__ (self, filename: str) :
         self.exact_callsign = {}
         self.prefix         = {}
-        self.prf_max        = 0
         self.countries      = {}
+        self.info_pool      = {}
 
         with io.open (filename, 'r') as f :
-            current_country: str = None
-            alias_lines = ''
-            for line in f:
-                line = line.strip()
-                if current_country is None :
-                    assert line.endswith(':')
-                    cdata = self.parse_country_line(line.rstrip(':'))
-                    current_country = cdata['country']
-                    self.countries[current_country] = cdata['data']
-                else:
-                    assert not line.endswith(':')
-                    if line.endswith (';') :
-                        alias_lines += line.rstrip (';')
-                        self.parse_alias_line(current_country, alias_lines)
-                        current_country = None
-                        alias_lines = ''
-                    else:
-                        assert line.endswith(',')
-                        alias_lines += line
+            text = f.read()
+        #every country is a header line ending with ':' followed by its alias lines, terminated by ';'
+        blocks = text.split(';')
+        assert not blocks[-1].strip()
+        for block in blocks[:-1]:
+            header, aliases = block.strip().split('\n', 1)
+            assert header.endswith(':')
+            cdata = self.parse_country_line(header.rstrip(':'))
+            current_country = cdata['country']
+            self.countries[current_country] = cdata['data']
+            self.parse_alias_line(current_country, ''.join(aliases.split()))
+        self.prefix_trie = self.build_prefix_trie()
+        self.lookup_cache = {}
 
     def parse_country_line(self, line_text):
         l = [x.lstrip() for x in line_text.split(':')]
@@ -95,63 +137,101 @@ class CTY:
         assert c_data is not None
         pfxs = line_text.split (',')
         for pfx in pfxs :
-            m = self.re_callsign.match(pfx)
-            assert m is not None
-            full_callsign, callsign, g_cq, g_itu = m.groups()
-            assert callsign is not None
-            l = len(callsign)
-            if l > self.prf_max:
-                self.prf_max = l
-            if full_callsign is not None:
-                if callsign not in self.exact_callsign:
-                    self.exact_callsign[callsign] = {
-                        'country': country,
-                        'cq': c_data['cq'],
-                        'itu': c_data['itu'],
-                        'continent': c_data['continent'],
-                        'lat': c_data['lat'],
-                        'lon': c_data['lon'],
-                        'gmtoff': c_data['gmtoff']
-                    }
-                    if g_cq is not None:
-                        self.exact_callsign[callsign]['cq'] = g_cq[1:-1]
-                    if g_itu is not None:
-                        self.exact_callsign[callsign]['itu'] = g_itu[1:-1]
-            else:
-                if callsign not in self.prefix:
-                    self.prefix[callsign] = {
-                        'country': country,
-                        'cq': c_data['cq'],
-                        'itu': c_data['itu'],
-                        'continent': c_data['continent'],
-                        'lat': c_data['lat'],
-                        'lon': c_data['lon'],
-                        'gmtoff': c_data['gmtoff']
-                    }
-                    if g_cq is not None:
-                        self.prefix[callsign]['cq'] = g_cq[1:-1]
-                    if g_itu is not None:
-                        self.prefix[callsign]['itu'] = g_itu[1:-1]
+            #[=]callsign followed by any of the override suffixes, without a regex per prefix.
+            #Only (cq) and [itu] are used, <lat/lon>, {aa} and ~tz~ are skipped like re_callsign did.
+            full_callsign = pfx.startswith('=')
+            callsign = pfx.lstrip('=')
+            g_cq = g_itu = None
+            end = len(callsign)
+            for c in '([<{~':
+                i = callsign.find(c, 0, end)
+                if i != -1:
+                    end = i
+            if end < len(callsign):
+                suffix = callsign[end:]
+                callsign = callsign[:end]
+                if '(' in suffix:
+                    g_cq = suffix[suffix.index('(') + 1:suffix.index(')')]
+                if '[' in suffix:
+                    g_itu = suffix[suffix.index('[') + 1:suffix.index(']')]
+            assert callsign
+            table = self.exact_callsign if full_callsign else self.prefix
+            if callsign not in table:
+                table[callsign] = self.country_info(country, c_data, g_cq, g_itu)
+
+    def country_info(self, country, c_data, cq = None, itu = None):
+        '''
+        Info dict as returned by callsign_lookup. Most prefixes of a country share the same zones,
+        so one dict per (country, cq, itu) is shared by all of them instead of one dict per prefix.
+        '''
+        cq = c_data['cq'] if cq is None else cq
+        itu = c_data['itu'] if itu is None else itu
+        key = (country, cq, itu)
+        info = self.info_pool.get(key)
+        if info is None:
+            info = self.info_pool[key] = {
+                'country': country,
+                'zone_cq': cq,
+                'zone_itu': itu,
+                'continent': c_data['continent'],
+                'lat': c_data['lat'],
+                'lon': c_data['lon'],
+                'gmtoff': c_data['gmtoff']
+            }
+        return info
+
+    def build_prefix_trie(self):
+        '''
+        Character trie of self.prefix for longest prefix match: {char: [info or None, {child char: ...}]}
+        '''
+        root = {}
+        for pfx, info in self.prefix.items():
+            node = root
+            for ch in pfx[:-1]:
+                node = node.setdefault(ch, [None, {}])[1]
+            node.setdefault(pfx[-1], [None, {}])[0] = info
+        return root
 
     def callsign_lookup (self, callsign) :
         '''
         return {
             'country': str,
-            'cq': str of integer,
-            'itu': str of integer,
+            'zone_cq': str of integer,
+            'zone_itu': str of integer,
             'continent': str of 2 chars,
             'lat': float, + for North
             'lon': float, + for West
             'gmtoff': float
         }
         '''
+        #the same stations are decoded over and over, the answer never changes for a callsign
+        cache = self.lookup_cache
+        try:
+            return cache[callsign]
+        except KeyError:
+            pass
+        if len(cache) >= self.lookup_cache_size:
+            cache.clear()
+        found = cache[callsign] = self.lookup_uncached(callsign)
+        return found
+
+    def lookup_uncached (self, callsign) :
+        '''
+        callsign_lookup without the cache
+        '''
         if callsign in self.exact_callsign :
             return self.exact_callsign[callsign]
-        for n in reversed(range(self.prf_max)) :
-            pfx = callsign[:n+1]
-            if pfx in self.prefix :
-                return self.prefix[pfx]
-        return None
+        #walk down the trie once, remember the deepest(longest) prefix that has info
+        found = None
+        node = self.prefix_trie
+        for ch in callsign:
+            nxt = node.get(ch)
+            if nxt is None:
+                break
+            if nxt[0] is not None:
+                found = nxt[0]
+            node = nxt[1]
+        return found
 
     def parse_wsjtx_decode_msg(self, msg):
         '''
@@ -210,6 +290,10 @@ class CTY:
             'peer':             str  OR None    callsign of the receiver
         }
         '''
+        #bind matchers once, they are tested several times per message
+        match_full_callsign = self.re_full_callsign.match
+        match_indicator = self.re_indicator.match
+        match_grid = self.is_grid
         pm = {
             'ERROR': None,
             'raw_message': msg,
@@ -231,84 +315,74 @@ class CTY:
         if ';' in msg:
             pm['ERROR'] = "Unknown message: %s" % msg
             return pm
-        l = msg.split ()
-        if len(l) < 1:
+        #walk the words with a cursor i, n is the end after stripping the marginal decode info
+        words = msg.split ()
+        n = len(words)
+        if n < 1:
             pm['ERROR'] = "Unknown message: %s" % msg
             return pm
         # Strip off marginal decode info
-        if l[-1].startswith('a') or l[-1] == '?':
-            l = l[:-1]
-        if len(l) < 1:
+        if words[-1].startswith('a') or words[-1] == '?':
+            n -= 1
+        if n < 1:
             pm['ERROR'] = "Unknown message: %s" % msg
             return pm
 
         #begin parse message...
         #CQ/QRZ/DE first
-        if l[0] in ('CQ', 'QRZ', 'DE'):
-            pm['mtype'] = l[0]
-            if len(l) < 2:
+        i = 0
+        if words[0] in self.msg_commands:
+            pm['mtype'] = words[0]
+            if n < 2:
                 pm['ERROR'] = "Unknown message: %s" % msg
                 return pm
             else:
-                l = l[1:]
-            if self.re_indicator.match(l[0]):
-                if len(l) < 2:
+                i = 1
+            if match_indicator(words[i]):
+                if n - i < 2:
                     pm['ERROR'] = "Unknown message: %s" % msg
                     return pm
                 else:
-                    l = l[1:]
+                    i += 1
             #now first word should be a callsign
-            if self.re_full_callsign.match(l[0]):
-                pm['caller'] = l[0]
+            if match_full_callsign(words[i]):
+                pm['caller'] = words[i]
                 info_data = self.callsign_lookup(pm['caller'])
                 if info_data is not None:
-                    pm['country'] = info_data['country']
-                    pm['zone_cq'] = info_data['cq']
-                    pm['zone_itu'] = info_data['itu']
-                    pm['continent'] = info_data['continent']
-                    pm['lat'] = info_data['lat']
-                    pm['lon'] = info_data['lon']
-                    pm['gmtoff'] = info_data['gmtoff']
-                l = l[1:]
-                if len(l) == 0:
+                    pm.update(info_data)
+                i += 1
+                if i == n:
                     return pm
-                if self.re_full_callsign.match(l[0]):
+                if match_full_callsign(words[i]):
                     #now this is a peer callsign
-                    pm['peer'] = l[0]
-                    if len(l) > 1 and self.re_grid.match(l[1]):
-                        pm['grid'] = l[1]
+                    pm['peer'] = words[i]
+                    if n - i > 1 and match_grid(words[i + 1]):
+                        pm['grid'] = words[i + 1]
                 else:
-                    if self.re_grid.match(l[0]):
-                        pm['grid'] = l[0]
+                    if match_grid(words[i]):
+                        pm['grid'] = words[i]
                 return pm
             else:
                 pm['ERROR'] = "Unknown message: %s" % msg
                 return pm
 
         #now deal with reply
-        if len(l) >= 2:
-            if self.re_full_callsign.match(l[0]):
+        if n >= 2:
+            if match_full_callsign(words[0]):
                 #got sender
-                pm['caller'] = l[0]
+                pm['caller'] = words[0]
                 info_data = self.callsign_lookup(pm['caller'])
                 if info_data is not None:
-                    pm['country'] = info_data['country']
-                    pm['zone_cq'] = info_data['cq']
-                    pm['zone_itu'] = info_data['itu']
-                    pm['continent'] = info_data['continent']
-                    pm['lat'] = info_data['lat']
-                    pm['lon'] = info_data['lon']
-                    pm['gmtoff'] = info_data['gmtoff']
-                l = l[1:]
-                if self.re_full_callsign.match(l[0]):
+                    pm.update(info_data)
+                if match_full_callsign(words[1]):
                     #now this is a peer callsign
-                    pm['peer'] = l[0]
+                    pm['peer'] = words[1]
                     pm['mtype'] = 'REPLAY'
-                    if len(l) > 1 and self.re_grid.match(l[1]) and l[1] != 'RR73':
-                        pm['grid'] = l[1]
+                    if n > 2 and match_grid(words[2]) and words[2] != 'RR73':
+                        pm['grid'] = words[2]
                 else:
-                    if self.re_grid.match(l[0]):
-                        pm['grid'] = l[0]
+                    if match_grid(words[1]):
+                        pm['grid'] = words[1]
                 return pm
 
         #free text and others...
@@ -316,22 +390,47 @@ class CTY:
 
 
 
+#fixed layouts used by the protocol elements, compiled once
+_S_B      = Struct('!B')
+_S_L      = Struct('!L')
+_S_Q      = Struct('!Q')
+_S_l      = Struct('!l')
+_S_qLB    = Struct('!qLB')
+_S_color  = Struct('!BHHHHH')
+_NULL_STR = _S_L.pack(0xFFFFFFFF)
+
 
 class Protocol_Element:
     """ A single protocol element to be parsed from binary format or
         serialized to binary format.
     """
 
+    #elements are created for every field of every telegram, keep them small
+    __slots__ = ('value',)
+
     def __init__(self, value):
         self.value = value
 
     @classmethod
     def deserialize(cls, dbytes, length = 0):
+        return cls.unpack_from(dbytes, 0, length)[0]
+
+    @classmethod
+    def unpack_from(cls, dbytes, offset = 0, length = 0):
+        """ Parse the element at offset of dbytes without slicing,
+            return (element, offset behind the element)
+        """
         raise NotImplementedError ("Needs to be define in sub-class")
 
     def serialize (self):
         raise NotImplementedError ("Needs to be define in sub-class")
 
+    @classmethod
+    def serialize_value (cls, value):
+        """ Serialize a plain value without keeping the element around
+        """
+        return cls(value).serialize()
+
     @property
     def serialization_size(self):
         raise NotImplementedError ("Needs to be define in sub-class")
@@ -351,23 +450,30 @@ class UTF8_String(Protocol_Element):
     b'\\xff\\xff\\xff\\xff'
     """
 
+    __slots__ = ()
+
     @classmethod
-    def deserialize(cls, dbytes, length = 0):
-        offset = 4
-        length = unpack('!L', dbytes[:offset])[0]
+    def unpack_from(cls, dbytes, offset = 0, length = 0):
+        length = _S_L.unpack_from(dbytes, offset)[0]
+        offset += 4
         # Special case empty (None?) string
         if length == 0xFFFFFFFF:
             value = None
-            return cls(value)
-        value  = unpack('%ds' % length, dbytes[offset:offset+length])[0]
-        return cls(value.decode ('utf-8'))
+            return cls(value), offset
+        if offset + length > len(dbytes):
+            raise StructError('utf8 string runs past the end of the datagram')
+        value  = dbytes[offset:offset+length]
+        return cls(str(value, 'utf-8')), offset + length
 
     def serialize(self):
-        if self.value is None:
-            return pack('!L', 0xFFFFFFFF)
-        length = len(self.value)
-        value  = self.value.encode('utf-8')
-        return pack('!L', length) + pack('%ds' % length, value)
+        return self.serialize_value(self.value)
+
+    @classmethod
+    def serialize_value (cls, value):
+        if value is None:
+            return _NULL_STR
+        length = len(value)
+        return _S_L.pack(length) + value.encode('utf-8')[:length]
 
     @property
     def serialization_size(self):
@@ -381,28 +487,34 @@ class Optional_Quint(Protocol_Element):
         We encode a missing value as None
     """
 
+    __slots__ = ('size',)
+
     formats = dict \
-        (( (1, '!B')
-        ,  (4, '!L')
-        ,  (8, '!Q')
+        (( (1, _S_B)
+        ,  (4, _S_L)
+        ,  (8, _S_Q)
         ))
 
     @classmethod
     def deserialize(cls, dbytes, length = 1):
-        if len(dbytes) == 0:
+        return cls.unpack_from(dbytes, 0, length)[0]
+
+    @classmethod
+    def unpack_from(cls, dbytes, offset = 0, length = 1):
+        if len(dbytes) <= offset:
             value = None
         else:
-            value = unpack(Optional_Quint.formats [length], dbytes)[0]
+            value = Optional_Quint.formats [length].unpack_from(dbytes, offset)[0]
         dobject = cls(value)
         dobject.size = length #pylint: disable=W0201
         if value is None:
             dobject.size = 0 #pylint: disable=W0201
-        return dobject
+        return dobject, offset + dobject.size
 
     def serialize(self):
         if self.value is None:
             return b''
-        return pack(self.formats [self.size], self.value)
+        return self.formats [self.size].pack(self.value)
 
     @property
     def serialization_size(self):
@@ -411,11 +523,62 @@ class Optional_Quint(Protocol_Element):
         return self.size
 
 
+class Fixed_Optional_Quint(Optional_Quint):
+    """ An Optional_Quint whose size is fixed by the class,
+        so no format lookup or size bookkeeping per value
+    >>> Optional_Quint8.deserialize (b'').serialize ()
+    b''
+    >>> Optional_Quint8 (2).serialize ()
+    b'\\x02'
+    """
+
+    __slots__ = ()
+    fixed = None
+
+    @classmethod
+    def unpack_from(cls, dbytes, offset = 0, length = 0):
+        if len(dbytes) <= offset:
+            return cls(None), offset
+        return cls(cls.fixed.unpack_from(dbytes, offset)[0]), offset + cls.fixed.size
+
+    def serialize(self):
+        if self.value is None:
+            return b''
+        return self.fixed.pack(self.value)
+
+    @property
+    def size(self):
+        return self.serialization_size
+
+    @property
+    def serialization_size(self):
+        if self.value is None:
+            return 0
+        return self.fixed.size
+
+
+class Optional_Quint8(Fixed_Optional_Quint):
+    __slots__ = ()
+    fixed = _S_B
+
+
+class Optional_Quint32(Fixed_Optional_Quint):
+    __slots__ = ()
+    fixed = _S_L
+
+
+class Optional_Quint64(Fixed_Optional_Quint):
+    __slots__ = ()
+    fixed = _S_Q
+
+
 class QDateTime(Protocol_Element):
     """ A QT DateTime object
         The case with a timezone is not used
     """
 
+    __slots__ = ('date', 'time', 'timespec', 'offset')
+
     def __init__(self, date, dtime, timespec, offset = None): #pylint: disable=W0231
         self.date     = date
         self.time     = dtime
@@ -426,17 +589,19 @@ class QDateTime(Protocol_Element):
             raise ValueError("Offset required when timespec=2")
 
     @classmethod
-    def deserialize(cls, dbytes, length = 0):
-        date, dtime, timespec = unpack('!qLB', dbytes[:13])
-        offset = None
+    def unpack_from(cls, dbytes, offset = 0, length = 0):
+        date, dtime, timespec = _S_qLB.unpack_from(dbytes, offset)
+        offset += 13
+        tz = None
         if timespec == 2:
-            offset = unpack('!l', dbytes[13:17])[0]
-        return cls(date, dtime, timespec, offset)
+            tz = _S_l.unpack_from(dbytes, offset)[0]
+            offset += 4
+        return cls(date, dtime, timespec, tz), offset
 
     def serialize(self):
-        r = [pack('!qLB', self.date, self.time, self.timespec)]
+        r = [_S_qLB.pack(self.date, self.time, self.timespec)]
         if self.offset is not None:
-            r.append(pack('!l', self.offset))
+            r.append(_S_l.pack(self.offset))
         return b''.join(r)
 
     @property
@@ -453,7 +618,7 @@ class QDateTime(Protocol_Element):
         s = ( 'QDatTime(date=%(date)s time=%(time)s '
             + 'timespec=%(timespec)s offset=%(offset)s)'
             )
-        return s % self.__dict__
+        return s % {k: getattr(self, k) for k in QDateTime.__slots__}
 
     __repr__ = __str__
 
@@ -464,7 +629,9 @@ class QColor(Protocol_Element):
         We support only RGB type or invalid
     """
 
-    fmt          = '!BHHHHH'
+    __slots__ = ('spec', 'red', 'green', 'blue', 'alpha')
+
+    fmt          = _S_color
     spec_rgb     = 1
     spec_invalid = 0
     cmax         = 0xFFFF
@@ -479,15 +646,13 @@ class QColor(Protocol_Element):
         self.alpha    = alpha
 
     @classmethod
-    def deserialize(cls, dbytes, length = 0):
-        b = dbytes[:cls.serialization_size]
-        s, a, r, g, b, dummy = unpack (cls.fmt, b)
-        return cls(spec = s, alpha = a, red = r, green = g, blue = b)
+    def unpack_from(cls, dbytes, offset = 0, length = 0):
+        s, a, r, g, b, dummy = cls.fmt.unpack_from (dbytes, offset)
+        return cls(spec = s, alpha = a, red = r, green = g, blue = b), offset + cls.serialization_size
 
     def serialize(self):
-        return pack \
-            ( self.fmt
-            , self.spec
+        return self.fmt.pack \
+            ( self.spec
             , self.alpha
             , self.red
             , self.green
@@ -505,23 +670,49 @@ class QColor(Protocol_Element):
         s = ( 'QColor(alpha=%(alpha)s, red=%(red)s, '
             + 'green=%(green)s, blue=%(blue)s)'
             )
-        return s % self.__dict__
+        return s % {k: getattr(self, k) for k in QColor.__slots__}
 
     __repr__ = __str__
 
 
-color_red      = QColor(red = QColor.cmax)
-color_green    = QColor(green = QColor.cmax)
-color_blue     = QColor(blue = QColor.cmax)
-color_white    = QColor(QColor.cmax, QColor.cmax, QColor.cmax)
-color_black    = QColor()
-color_cyan     = QColor(0, 0xFFFF, 0xFFFF)
-color_cyan1    = QColor(0x9999, 0xFFFF, 0xFFFF)
-color_pink     = QColor(0xFFFF, 0, 0xFFFF)
-color_pink1    = QColor(0xFFFF, 0xAAAA, 0xFFFF)
-color_orange   = QColor(0xFFFF, 0xA0A0, 0x0000)
+class Frozen_QColor(QColor):
+    """ A read only QColor for the color constants below,
+        it is serialized once when created
+    >>> color_red.serialize () == QColor (red = QColor.cmax).serialize ()
+    True
+    >>> color_red.red = 0
+    Traceback (most recent call last):
+    ...
+    AttributeError: color constants are read only
+    """
+
+    __slots__ = ('packed',)
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self.packed = QColor.serialize(self)
 
-color_invalid  = QColor(spec = QColor.spec_invalid)
+    def __setattr__(self, name, value):
+        if hasattr(self, 'packed'):
+            raise AttributeError('color constants are read only')
+        super().__setattr__(name, value)
+
+    def serialize(self):
+        return self.packed
+
+
+color_red      = Frozen_QColor(red = QColor.cmax)
+color_green    = Frozen_QColor(green = QColor.cmax)
+color_blue     = Frozen_QColor(blue = QColor.cmax)
+color_white    = Frozen_QColor(QColor.cmax, QColor.cmax, QColor.cmax)
+color_black    = Frozen_QColor()
+color_cyan     = Frozen_QColor(0, 0xFFFF, 0xFFFF)
+color_cyan1    = Frozen_QColor(0x9999, 0xFFFF, 0xFFFF)
+color_pink     = Frozen_QColor(0xFFFF, 0, 0xFFFF)
+color_pink1    = Frozen_QColor(0xFFFF, 0xAAAA, 0xFFFF)
+color_orange   = Frozen_QColor(0xFFFF, 0xA0A0, 0x0000)
+
+color_invalid  = Frozen_QColor(spec = QColor.spec_invalid)
 ctuple_invalid = (color_invalid, color_invalid)
 
 # defaults (fg color, bg color)
@@ -541,7 +732,7 @@ qint32     = ('!l', 4)
 qbool      = quint8
 qutf8      = (UTF8_String, 0)
 qdouble    = ('!d', 8)
-opt_quint8 = (Optional_Quint, 1)
+opt_quint8 = (Optional_Quint8, 1)
 qtime      = quint32
 qdatetime  = (QDateTime, 0)
 qcolor     = (QColor, 0)
@@ -579,19 +770,9 @@ class WSJTX_Telegram():
     # Individual telegrams register here:
     type_registry = {}
 
-    def __init__ (self, **kw) :
-        params = {}
-        params.update(self.defaults)
-        params.update(kw)
-        if 'type' not in params:
-            params['type'] = self.type
-        assert params['magic'] == self.magic
-        assert self.schema_version_number >= params['version_number']
-        # Thats for sub-classes, they have their own format
-        for name, (_, _) in self.format:
-            setattr(self, name, params [name])
-        if self.__class__.type is not None:
-            assert self.__class__.type == self.type
+    # __init__ (self, **kw) is generated per class, see generate_init:
+    # the fields of self.format are set from kw or self.defaults, a
+    # type not given is the one of the class, other kw are ignored.
 
 
     @classmethod
@@ -607,38 +788,161 @@ class WSJTX_Telegram():
             return self
 
 
+    def __init_subclass__(cls, **kw):
+        super().__init_subclass__(**kw)
+        cls.compile_format()
+
     @classmethod
-    def deserialize(cls, dbytes):
-        b  = dbytes
-        kw = {}
+    def compile_format(cls):
+        """ Precompile cls.format into cls.layout, done once per class.
+            Each run of consecutive struct fields is merged into one
+            Struct: (Struct, names, ((Struct, len), ...)) where the per
+            field Structs are only used for short (older format) buffers.
+            A Protocol_Element field is kept on its own: (None, name,
+            (Protocol_Element class, len)).
+        """
+        layout = []
+        run = []
+        def close_run():
+            if run:
+                fmt = '!' + ''.join(f[1:] for _, f, _ in run)
+                layout.append \
+                    ( ( Struct(fmt)
+                      , tuple(n for n, _, _ in run)
+                      , tuple((Struct(f), length) for _, f, length in run)
+                    ) )
+                run.clear()
         for name, (dformat, length) in cls.format:
-            # Due to compatibility reasons new message fields are added to
-            # the end of the messsage. The buffer is empty when the message
-            # is older format and a field is missing.
-            if len(b) == 0:
-                kw[name] = None
-                continue
+            assert name.isidentifier()
             if isinstance(dformat, type('')):
-                kw[name] = unpack(dformat, b[:length])[0]
-                b = b[length:]
-            else :
-                value = dformat.deserialize(b, length)
-                b = b[value.serialization_size:]
-                kw[name] = value.value
-        return kw
+                run.append((name, dformat, length))
+            else:
+                close_run()
+                layout.append((None, name, (dformat, length)))
+        close_run()
+        cls.layout = layout
+        cls.generate_codec()
+        cls.generate_init()
 
+    @classmethod
+    def generate_init(cls):
+        """ Generate __init__ taking the fields of cls.format as keyword
+            arguments, defaults of cls.defaults bound as parameter defaults,
+            so no dicts are built per telegram.
+        """
+        env = {}
+        defaults = dict(type = cls.type, **cls.defaults)
+        params = []
+        for name, (_, _) in cls.format:
+            if name in defaults:
+                env['d_' + name] = defaults[name]
+                params.append('%s = d_%s' % (name, name))
+            else:
+                params.append(name)
+        src = \
+            [ 'def __init__(self, *, %s, **_kw):' % ', '.join(params)
+            , '    assert magic == self.magic'
+            , '    assert self.schema_version_number >= version_number'
+            ]
+        src.extend('    self.%s = %s' % (n, n) for n, _ in cls.format)
+        src.append('    if self.__class__.type is not None:')
+        src.append('        assert self.__class__.type == self.type')
+        code = '\n'.join(src) + '\n'
+        exec(compile(code, '<%s init>' % cls.__name__, 'exec'), env) #pylint: disable=W0122
+        cls.__init__ = env['__init__']
 
-    def as_bytes(self):
-        r = []
-        for name, (fmt, _) in self.format:
-            v = getattr(self, name)
-            if isinstance(v, Protocol_Element):
-                r.append (v.serialize ())
-            elif isinstance(fmt, type('')):
-                r.append(pack(fmt, v))
+
+    @classmethod
+    def generate_codec(cls):
+        """ Generate straight line deserialize and as_bytes methods from
+            cls.layout, as they would be written by hand for the class.
+            A short (older format) buffer makes the generated deserialize
+            fall back to the generic deserialize_layout.
+        """
+        env = dict \
+            ( Protocol_Element = Protocol_Element
+            , StructError      = StructError
+            )
+        dsrc = \
+            [ 'def deserialize(cls, dbytes):'
+            , '    end = len(dbytes)'
+            , '    try:'
+            ]
+        asrc = ['def as_bytes(self):', '    return b"".join((']
+        offset = 0 #known offset up to the first variable size element
+        for i, (st, names, spec) in enumerate(cls.layout):
+            pos = 'off' if offset is None else str(offset)
+            if st is not None:
+                env['unpack%d' % i] = st.unpack_from
+                env['pack%d' % i]   = st.pack
+                dsrc.append \
+                    ( '        %s, = unpack%d(dbytes, %s)'
+                    % (', '.join('f_' + n for n in names), i, pos)
+                    )
+                if offset is None:
+                    dsrc.append('        off += %d' % st.size)
+                else:
+                    offset += st.size
+                asrc.append \
+                    ( '        pack%d(%s),'
+                    % (i, ', '.join('self.' + n for n in names))
+                    )
             else:
-                r.append(fmt (v).serialize())
-        return b''.join(r)
+                dformat, length = spec
+                env['element%d' % i]   = dformat.unpack_from
+                env['serialize%d' % i] = dformat.serialize_value
+                dsrc.append('        if %s >= end: raise StructError' % pos)
+                dsrc.append \
+                    ('        v, off = element%d(dbytes, %s, %d)' % (i, pos, length))
+                dsrc.append('        f_%s = v.value' % names)
+                offset = None
+                asrc.append \
+                    ( '        v.serialize() if isinstance(v := self.%s, '
+                      'Protocol_Element) else serialize%d(v),'
+                    % (names, i)
+                    )
+        dsrc.append('    except StructError:')
+        dsrc.append('        return cls.deserialize_layout(dbytes)')
+        dsrc.append \
+            ( '    return {%s}'
+            % ', '.join('%r: f_%s' % (n, n) for n, _ in cls.format)
+            )
+        asrc.append('    ))')
+        code = '\n'.join(dsrc) + '\n\n' + '\n'.join(asrc) + '\n'
+        exec(compile(code, '<%s codec>' % cls.__name__, 'exec'), env) #pylint: disable=W0122
+        cls.deserialize = classmethod(env['deserialize'])
+        cls.as_bytes    = env['as_bytes']
+
+
+    @classmethod
+    def deserialize_layout(cls, dbytes):
+        b   = dbytes
+        end = len(b)
+        off = 0
+        kw  = {}
+        for st, names, spec in cls.layout:
+            if st is not None:
+                if end - off >= st.size:
+                    kw.update(zip(names, st.unpack_from(b, off)))
+                    off += st.size
+                    continue
+                # Due to compatibility reasons new message fields are added to
+                # the end of the messsage. The buffer is short/empty when the
+                # message is older format and a field is missing.
+                for name, (fst, length) in zip(names, spec):
+                    if off >= end:
+                        kw[name] = None
+                        continue
+                    kw[name] = fst.unpack_from(b, off)[0]
+                    off += length
+            else :
+                if off >= end:
+                    kw[names] = None
+                    continue
+                dformat, length = spec
+                value, off = dformat.unpack_from(b, off, length)
+                kw[names] = value.value
+        return kw
 
 
     def __str__ (self):
@@ -650,6 +954,8 @@ class WSJTX_Telegram():
 
     __repr__ = __str__
 
+WSJTX_Telegram.compile_format()
+
 
 class WSJTX_Heartbeat(WSJTX_Telegram):
 
@@ -897,6 +1203,12 @@ class WSJTX_Configure(WSJTX_Telegram) :
 WSJTX_Telegram.type_registry[WSJTX_Configure.type] = WSJTX_Configure
 
 
+# Some regexes for matching, bound to their match method once
+_MATCH_REPORT = re.compile(r'[R]?[-+][0-9]{2}').match
+_MATCH_LOC    = re.compile(r'[A-Z]{2}[0-9]{2}').match
+_MATCH_CALL   = re.compile \
+    (r'(([A-Z])|([A-Z][A-Z0-9])|([0-9][A-Z]))[0-9][A-Z]{1,3}').match
+_SEARCH_DIGIT = re.compile(r'[0-9]').search
 
 
 class UDP_Connector:
@@ -904,20 +1216,58 @@ class UDP_Connector:
     Receive ft8 decoded message from wsjt-x app, then send parsed info to a thread queue.
     '''
 
+    RECV_SIZE   = 4096
+    RCVBUF_SIZE = 12 << 20  #kernel caps it at net.core.rmem_max
+    MAX_BATCH   = 32        #datagrams handled per wakeup
+    magic_bytes = _S_L.pack(WSJTX_Telegram.magic)
+
     def __init__ (self, cty_parser, msg_pipe, ip = '127.0.0.1', port = 2237, did = None):
         self.cty_parser = cty_parser
         self.msg_pipe = msg_pipe
         self.ip      = ip
         self.port    = port
         self.socket  = socket(AF_INET, SOCK_DGRAM)
+        #a whole period of decodes arrives in one burst, don't drop it while we are busy.
+        #linux clamps the size silently, macOS/BSD refuse one above kern.ipc.maxsockbuf(ENOBUFS)
+        try:
+            self.socket.setsockopt(SOL_SOCKET, SO_RCVBUF, self.RCVBUF_SIZE)
+            refused = None
+        except OSError as err:
+            refused = err
+        #linux reports the doubled value(bookkeeping overhead), halve it back to compare with the request
+        rcvbuf = self.socket.getsockopt(SOL_SOCKET, SO_RCVBUF)
+        if sys.platform.startswith('linux'):
+            rcvbuf //= 2
+        if refused is not None:
+            log(f'wsjt_srv udp receive buffer of {self.RCVBUF_SIZE} bytes refused({refused}), left at {rcvbuf} bytes,'
+                ' raise net.core.rmem_max or kern.ipc.maxsockbuf')
+        elif rcvbuf < self.RCVBUF_SIZE:
+            log(f'wsjt_srv udp receive buffer clamped to {rcvbuf} bytes, raise net.core.rmem_max')
         self.peer    = {}
         self.adr     = None
         self.id      = did
         self.dx_call = None
         self.socket.bind((self.ip, self.port))
+        #drain reads must not block: per call flag if we have it, else a non-blocking
+        #socket and a selector to wait for the first datagram
+        self.selector = None
+        self.nowait   = MSG_DONTWAIT
+        if MSG_DONTWAIT is None:
+            self.socket.setblocking(False)
+            self.selector = DefaultSelector()
+            self.selector.register(self.socket, EVENT_READ)
+            self.nowait = 0
         if did is None:
             self.id = WSJTX_Telegram.defaults['id']
         self.heartbeat_seen = False
+        #our heartbeat never changes, build it once
+        self.heartbeat_bytes = WSJTX_Heartbeat(version = '4711', id = self.id).as_bytes()
+        #telegram type -> handler, see handle()
+        self.handlers = \
+            { WSJTX_Heartbeat.type : self.handle_heartbeat
+            , WSJTX_Decode.type    : self.handle_decode
+            , WSJTX_Close.type     : self.handle_close
+            }
 
 
     def handle (self, tel):
@@ -926,12 +1276,17 @@ class UDP_Connector:
             In addition we parse Decode messages, extract the call sign
             and determine worked-before and coloring.
         """
-        if not self.heartbeat_seen or isinstance(tel, WSJTX_Heartbeat):
+        if not self.heartbeat_seen and tel.type != WSJTX_Heartbeat.type:
             self.heartbeat()
-        if isinstance(tel, WSJTX_Decode):
-            self.handle_decode (tel)
-        if isinstance(tel, WSJTX_Close):
-            self.handle_close (tel)
+        handler = self.handlers.get(tel.type)
+        if handler is not None:
+            handler(tel)
+
+    def handle_heartbeat(self, tel):
+        """ Answer every heartbeat, no need to send unasked ones after the first
+        """
+        self.heartbeat_seen = True
+        self.heartbeat()
 
     def handle_close(self, tel):
         """ Just exit when wsjtx exits
@@ -944,7 +1299,12 @@ class UDP_Connector:
     def handle_decode(self, tel):
         if tel.off_air or not tel.is_new:
             return
-        msg = self.cty_parser.parse_wsjtx_decode_msg(tel.message or '')
+        message = tel.message
+        #the web server only counts reports with a caller, and finding one takes two
+        #words and a callsign with a digit: skip free text and junk without parsing
+        if not message or len(message) < 5 or ' ' not in message or _SEARCH_DIGIT(message) is None:
+            return
+        msg = self.cty_parser.parse_wsjtx_decode_msg(message)
         if msg['ERROR'] is not None:
             log(f"wsjt_srv error when decode message: {msg['ERROR']}")
             return
@@ -957,15 +1317,14 @@ class UDP_Connector:
         self.msg_pipe.put(msg)
 
     def heartbeat(self, **kw) :
-        tel = WSJTX_Heartbeat(version = '4711', **kw)
-        self.socket.sendto(tel.as_bytes(), self.adr)
-
+        if self.adr is None:
+            return
+        if kw:
+            tel = WSJTX_Heartbeat(version = '4711', id = self.id, **kw)
+            self.socket.sendto(tel.as_bytes(), self.adr)
+        else:
+            self.socket.sendto(self.heartbeat_bytes, self.adr)
 
-    # Some regexes for matching
-    re_report = re.compile(r'[R]?[-+][0-9]{2}')
-    re_loc    = re.compile(r'[A-Z]{2}[0-9]{2}')
-    re_call   = re.compile \
-        (r'(([A-Z])|([A-Z][A-Z0-9])|([0-9][A-Z]))[0-9][A-Z]{1,3}')
 
     def is_locator(self, s) :
         """ Check if s is a locator
@@ -978,7 +1337,7 @@ class UDP_Connector:
         False
         >>> u.socket.close ()
         """
-        return bool(self.re_loc.match(s))
+        return _MATCH_LOC(s) is not None
 
 
     def is_report(self, s) :
@@ -994,7 +1353,7 @@ class UDP_Connector:
         True
         >>> u.socket.close ()
         """
-        return bool(self.re_report.match(s))
+        return _MATCH_REPORT(s) is not None
 
 
     def is_stdcall(self, s) :
@@ -1008,19 +1367,92 @@ class UDP_Connector:
         True
         >>> u.socket.close ()
         """
-        return bool(self.re_call.match(s))
+        return _MATCH_CALL(s) is not None
+
+
+    def wait_datagram(self, recv, arg) :
+        """ Block until recv(arg) reads a datagram and return its result,
+            recv is the socket's recvfrom_into.
+        """
+        while True:
+            if self.selector is not None:
+                self.selector.select()
+            try:
+                return recv(arg)
+            except BlockingIOError: #spurious wakeup of the selector
+                pass
+
+
+    def receiver(self, work_pipe) :
+        """ Thread body: only read datagrams and pass them on to work_pipe,
+            so the socket is drained while the decoding thread parses.
+            Each wakeup puts one list of up to MAX_BATCH (bytes, address).
+            All reads go to one preallocated buffer, each datagram is then
+            copied out at its length, it outlives the next read.
+            A socket error other than a connection reset/refused ends the
+            thread, the error itself is put last for main to raise.
+        """
+        recvfrom_into = self.socket.recvfrom_into
+        wait_datagram = self.wait_datagram
+        buf  = bytearray(self.RECV_SIZE)
+        view = memoryview(buf)
+        nowait = self.nowait
+        n = self.MAX_BATCH - 1
+        while True:
+            batch = []
+            try:
+                nbytes, address = wait_datagram(recvfrom_into, buf)
+                batch.append((view[:nbytes].tobytes(), address))
+                for _ in range(n):
+                    nbytes, address = recvfrom_into(buf, 0, nowait)
+                    batch.append((view[:nbytes].tobytes(), address))
+            except BlockingIOError:
+                pass
+            except ConnectionError as err:
+                #windows reports the ICMP port unreachable of an earlier sendto here, the socket is fine
+                log(f'wsjt_srv udp receive error: {err}')
+            except OSError as err:
+                if batch:
+                    work_pipe.put(batch)
+                work_pipe.put(err)
+                return
+            if batch:
+                work_pipe.put(batch)
+
+
+    def dispatch_batch(self, batch) :
+        """ Handle a list of (bytes, address) put by receiver.
+        """
+        dispatch = self.dispatch
+        for dbytes, address in batch:
+            dispatch(dbytes, address)
 
 
-    def receive(self) :
-        dbytes, address = self.socket.recvfrom(4096)
-        tel = WSJTX_Telegram.from_bytes(dbytes)
+    def dispatch(self, dbytes, address) :
+        """ Parse and handle one datagram, return the telegram or None
+            when it was not parsed.
+            Datagrams without the WSJT-X magic are dropped unparsed, from
+            a non preferred peer only the header is read to learn its id.
+        """
+        if dbytes[:4] != self.magic_bytes:
+            return None
+        try:
+            if self.adr is not None and self.adr != address:
+                tid = WSJTX_Telegram.deserialize(dbytes)['id']
+                if tid not in self.peer:
+                    self.peer[tid] = address
+                return None
+            tel = WSJTX_Telegram.from_bytes(dbytes)
+        except (StructError, ValueError, TypeError) as err:
+            #cut or garbled: ValueError for bad utf-8, TypeError for a header cut short(None version)
+            log(f'wsjt_srv drop datagram from {address}: {err}')
+            return None
         if tel.id not in self.peer:
             self.peer[tel.id] = address
         if not self.adr:
             self.adr = address
         # Only handle messages from preferred peer for now
-        if self.adr == address:
-            self.handle(tel)
+        self.handle(tel)
         return tel
 
 
@@ -1032,30 +1464,65 @@ class UDP_Connector:
 
 
 SENDING_PERIOD = 30     #web report sending period. In second.
-job_done = False
-
-def handle_msg(ml, parsed_url):
+job_done = Event()      #set to stop the sender thread
+#built once for every post, without the blanks json.dumps puts after separators
+json_encode = json.JSONEncoder(separators=(',', ':')).encode
+
+#ask for keep-alive explicitly, some gateways and HTTP/1.0 proxies close the connection otherwise
+POST_HEADERS = {'Content-type': 'application/json', 'Connection': 'keep-alive'}
+
+def connect_web(parsed_url):
+    if parsed_url.scheme == 'https':
+        return http.client.HTTPSConnection(parsed_url.hostname, port=parsed_url.port or 443)
+    return http.client.HTTPConnection(parsed_url.hostname, port=parsed_url.port or 80)
+
+def handle_msg(ml, parsed_url, target, conn = None):
+    """ Post one batch of messages to target(path?query of parsed_url), return the
+        connection for the next batch.
+        The connection is kept alive between batches, a stale one is replaced and
+        the post retried once.
+    """
     print(f'{ml}') #log go to stderr, and msg go to stdout
-    try:
-        conn = http.client.HTTPSConnection(parsed_url.hostname, port=parsed_url.port or 443) if parsed_url.scheme == 'https' else http.client.HTTPConnection(parsed_url.hostname, port=parsed_url.port or 80)
-        headers = {'Content-type': 'application/json'}
-        json_data = json.dumps(ml)
-        conn.request('POST', f'{parsed_url.path}?{parsed_url.query}', json_data, headers)
-        response = conn.getresponse()
-        if response.status != 200:
-            log(f'Error from web server({response.status}):')
-            log(f'{response.read().decode()}')
-    except Exception as err: #pylint: disable=W0718
-        log(f'Error when send to web server:{err}')
+    json_data = json_encode(ml).encode()
+    headers = dict(POST_HEADERS)
+    headers['Content-Length'] = str(len(json_data))
+    for retry in (False, True):
+        try:
+            if conn is None:
+                conn = connect_web(parsed_url)
+            conn.request('POST', target, json_data, headers)
+            response = conn.getresponse()
+            body = response.read() #always drain, the connection is reused
+            if response.status // 100 != 2: #the sqlite api answers 202, saving later
+                log(f'Error from web server({response.status}):')
+                log(f'{body.decode()}')
+            if response.will_close:
+                conn.close()
+                conn = None
+            return conn
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as err:
+            conn.close()
+            conn = None
+            if retry:
+                log(f'Error when send to web server:{err}')
+        except Exception as err: #pylint: disable=W0718
+            log(f'Error when send to web server:{err}')
+            if conn is not None:
+                conn.close()
+            return None
+    return None
 
 
 def sender(taskQueue, parsed_url):
+    """ Post everything queued once per SENDING_PERIOD.
+        Sleeps on job_done between posts, so setting it ends the thread at once.
+    """
     ml = []
-    while not job_done:
-        for _ in range(SENDING_PERIOD):
-            time.sleep(1)
-            if job_done:
-                return
+    conn = None
+    target = f'{parsed_url.path}?{parsed_url.query}'
+    deadline = time.monotonic() + SENDING_PERIOD
+    while not job_done.wait(max(0, deadline - time.monotonic())):
+        deadline += SENDING_PERIOD
         isEmpty = False
         while not isEmpty:
             try:
@@ -1063,8 +1530,11 @@ def sender(taskQueue, parsed_url):
                 ml.append(m)
             except Empty:
                 isEmpty = True
-        handle_msg(ml, parsed_url)
+        #an empty list still goes out, the server keeps it as this station being alive
+        conn = handle_msg(ml, parsed_url, target, conn)
         ml = []
+    if conn is not None:
+        conn.close()
 
 def usage():
     print("""Wsjtx message server, send decoded messages to remote web api gateway.
@@ -1076,6 +1546,8 @@ def usage():
                                     Web data server api connection string. "id" for station name, "band", for ft8 band, "token" for password
         
           Note: band string in [.0-9a-zA-Z] 
+                The udp receive buffer asks for 12 MiB to ride out decode bursts, on linux allow it with
+                    sysctl -w net.core.rmem_max=12582912
         """)
 
 def main():
@@ -1111,22 +1583,33 @@ def main():
         usage()
         sys.exit()
 
+    listener = start_log_listener()
     tq = Queue()
+    ts = Thread(target=sender, args=[tq, parsed_url])
     try:
-        ts = Thread(target=sender, args=[tq, parsed_url])
         ts.start()
         cty = CTY(ctyfile)
         udp_srv = UDP_Connector(cty, tq, addr, port)
+        #the socket is read on its own thread, parsing here never keeps it waiting
+        wq = Queue()
+        tr = Thread(target=udp_srv.receiver, args=[wq], daemon=True)
+        tr.start()
 
         log(f'{datetime.datetime.now().strftime("%H:%M:%S")}: ft8 monitor start.')
         while True:
-            udp_srv.receive()
+            batch = wq.get()
+            if isinstance(batch, OSError): #the receiver thread is gone
+                raise batch
+            udp_srv.dispatch_batch(batch)
 
     except KeyboardInterrupt:
         log("Caught KeyboardInterrupt, terminating thread...")
-        global job_done     #pylint: disable=W0603
-        job_done = True
-        ts.join()
+    finally:
+        #also on errors, the sender thread would keep the process alive
+        job_done.set()
+        if ts.is_alive():
+            ts.join()
+        stop_log_listener(listener)
     log(f'{datetime.datetime.now().strftime("%H:%M:%S")}: ft8 monitor exit.')
 
 if __name__ == '__main__' :
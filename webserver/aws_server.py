@@ -2,17 +2,33 @@
 A amazon AWS Lambda function for API Gateway, use Dynamodb storing data.
 Note: 
 1. You should upload this script together with data_server.py.
-2. Need dynamodb's DescribeTable/CreateTable/Query/PutItem policies.
+2. Need dynamodb's DescribeTable/CreateTable/UpdateTable/Query/PutItem/BatchWriteItem policies.
+   Tables are created on-demand(PAY_PER_REQUEST), older provisioned tables are switched once at cold start.
 3. First time run take 20~30s to create tables, you should set lambda execute timeout 30s+. Or you can create dynamodb tables manually.
 4. You may need to open cors on AWS API gateway service.
+5. GET /minutes leaves out the big messages/callers attributes unless asked with full=1 or fields=a,b,...
 """
 import json
 from os import environ
-from typing import List
+from typing import List, Dict
 import boto3
 from botocore.exceptions import ClientError
 from boto3.dynamodb.conditions import Key
-from data_server import Data_Server, Monitor_Message, Minutes_Record, Hours_Record, Minutes_Record_Encoder, Hours_Record_Encoder
+from data_server import Data_Server, Minutes_Record, Hours_Record, records_json, report_messages
+
+
+def counts(attr) -> Dict[str, int]:
+    """Counter maps are stored as native DynamoDB maps, numbers come back as Decimal.
+        Rows written by older versions hold a JSON string instead.
+    """
+    if isinstance(attr, str):
+        return json.loads(attr)
+    return {k: int(n) for k, n in attr.items()}
+
+
+#key attributes of both tables, the condition builders are reused by every query
+KEY_MONITOR_BAND = Key('monitor_band')
+KEY_CTIME = Key('ctime')
 
 
 class Dynamodb_Server(Data_Server):
@@ -23,7 +39,7 @@ class Dynamodb_Server(Data_Server):
     TB_MINUTES = 'ft8mon_minutes'
     TB_HOURS = 'ft8mon_hours'
     RETURN_RECORD_LIMIT = 720 #12 hours of minutes data or 30 days of hours data
-    CAPACITY_UNITS = 5
+    BILLING_MODE = 'PAY_PER_REQUEST' #on-demand, bursts at the top of each minute are not throttled
 
     def __init__(self) -> None:
         super().__init__()
@@ -33,6 +49,8 @@ class Dynamodb_Server(Data_Server):
             self.create_minutes_table()
         if not self.tb_exists(self.TB_HOURS):
             self.create_hours_table()
+        self.tb_minutes = self.table[self.TB_MINUTES]
+        self.tb_hours = self.table[self.TB_HOURS]
 
     def tb_exists(self, table_name):
         try:
@@ -47,8 +65,21 @@ class Dynamodb_Server(Data_Server):
                 raise
         else:
             self.table[table_name] = table
+            self.set_on_demand(table)
         return exists
 
+    def set_on_demand(self, table):
+        """Switch a table created with provisioned capacity by older versions to on-demand.
+            Failure is not fatal, the table keeps working with its provisioned capacity.
+        """
+        summary = table.billing_mode_summary or {}
+        if summary.get('BillingMode', 'PROVISIONED') == self.BILLING_MODE:
+            return
+        try:
+            table.update(BillingMode=self.BILLING_MODE)
+        except ClientError as err:
+            print(f"Error(code {err.response['Error']['Code']}) when set table {table.name} billing mode: {err.response['Error']['Message']}")
+
     def create_minutes_table(self):
         try:
             self.table[self.TB_MINUTES] = self.dyn_resource.create_table(
@@ -73,10 +104,7 @@ class Dynamodb_Server(Data_Server):
                         'KeyType': 'RANGE'
                     }
                 ],
-                ProvisionedThroughput = {
-                    'ReadCapacityUnits': self.CAPACITY_UNITS,
-                    'WriteCapacityUnits': self.CAPACITY_UNITS
-                })
+                BillingMode = self.BILLING_MODE)
             self.table[self.TB_MINUTES].wait_until_exists()
         except ClientError as err:
             print(f"Error(code {err.response['Error']['Code']}) when create table {self.TB_MINUTES}: {err.response['Error']['Message']}")
@@ -108,10 +136,7 @@ class Dynamodb_Server(Data_Server):
                         'KeyType': 'RANGE'
                     }
                 ],
-                ProvisionedThroughput={
-                    'ReadCapacityUnits': self.CAPACITY_UNITS,
-                    'WriteCapacityUnits': self.CAPACITY_UNITS
-                })
+                BillingMode=self.BILLING_MODE)
             self.table[self.TB_HOURS].wait_until_exists()
         except ClientError as err:
             print(f"Error(code {err.response['Error']['Code']}) when create table {self.TB_HOURS}: {err.response['Error']['Message']}")
@@ -120,17 +145,50 @@ class Dynamodb_Server(Data_Server):
             return self.table[self.TB_HOURS]
 
 
-    def db_upsert_minute(self, monitor:str, band: str, data: Minutes_Record) -> str | None:
-        rec = {
+    def minute_item(self, data: Minutes_Record) -> dict:
+        return {
             'monitor_band': f'{data.monitor}#{data.band}',
             'ctime': data.ctime,
             'messages': data.messages,
             'total': data.total,
             'snr': data.snr,
-            'countries': json.dumps(data.countries),
-            'cqs': json.dumps(data.cqs),
-            'callers': json.dumps(data.callers)
+            'countries': data.countries,
+            'cqs': data.cqs,
+            'callers': data.callers
         }
+
+    def hour_item(self, data: Hours_Record) -> dict:
+        return {
+            'monitor_band': f'{data.monitor}#{data.band}',
+            'ctime': data.ctime,
+            'total': data.total,
+            'snr': data.snr,
+            'countries': data.countries,
+            'cqs': data.cqs
+        }
+
+    def batch_put(self, table_name: str, items) -> str | None:
+        """Put items with BatchWriteItem, 25 items per request, unprocessed items are resent by boto3."""
+        try:
+            with self.table[table_name].batch_writer() as bw:
+                for item in items:
+                    bw.put_item(Item=item)
+        except ClientError as err:
+            msg = f"Error(code {err.response['Error']['Code']}) when update table {table_name}: {err.response['Error']['Message']}"
+            print(msg)
+            return msg
+        else:
+            return None
+
+    def db_upsert_minutes(self, monitor:str, band: str, data: List[Minutes_Record]) -> str | None:
+        return self.batch_put(self.TB_MINUTES, [self.minute_item(d) for d in data])
+
+    def db_upsert_hours(self, monitor:str, band: str, data: List[Hours_Record]) -> str | None:
+        return self.batch_put(self.TB_HOURS, [self.hour_item(d) for d in data])
+
+
+    def db_upsert_minute(self, monitor:str, band: str, data: Minutes_Record) -> str | None:
+        rec = self.minute_item(data)
         try:
             self.table[self.TB_MINUTES].put_item(Item=rec)
         except ClientError as err:
@@ -141,24 +199,39 @@ class Dynamodb_Server(Data_Server):
             return None
 
 
-    def db_read_minutes(self, monitor:str, band: str, begin: int, end: int) -> List[Minutes_Record]:
+    @staticmethod
+    def projection(fields: List[str] | None) -> dict:
+        """Query kwargs reading only the given attributes(plus the keys), all of them for None.
+            Names are aliased, some of them are DynamoDB reserved words.
+        """
+        if fields is None:
+            return {}
+        names = ['monitor_band', 'ctime'] + [f for f in fields if f not in ('monitor_band', 'ctime')]
+        return {
+            'ProjectionExpression': ','.join(f'#f{i}' for i in range(len(names))),
+            'ExpressionAttributeNames': {f'#f{i}': n for i, n in enumerate(names)}
+        }
+
+    def db_read_minutes(self, monitor:str, band: str, begin: int, end: int, fields: List[str] | None = None) -> List[Minutes_Record]:
+        """fields: attributes to read, None for all. Attributes not read are left empty in the records."""
         recs: List[Minutes_Record] = []
         try:
-            for row in self.table[self.TB_MINUTES].query(
-                KeyConditionExpression=Key('monitor_band').eq(f'{monitor}#{band}') & Key('ctime').between(begin, end),
-                Limit=self.RETURN_RECORD_LIMIT
+            for row in self.tb_minutes.query(
+                KeyConditionExpression=KEY_MONITOR_BAND.eq(f'{monitor}#{band}') & KEY_CTIME.between(begin, end),
+                Limit=self.RETURN_RECORD_LIMIT,
+                **self.projection(fields)
             )['Items']:
-                mb = row['monitor_band'].split('#')
+                #monitor_band is the query key, no need to split it again
                 rec = Minutes_Record(
                     ctime=int(row['ctime']), #note DynamoDB return Decimal even with a int(hate this!!!)
-                    monitor=mb[0],
-                    band=mb[1],
-                    messages=row['messages'],
-                    total=int(row['total']),
-                    snr=int(row['snr']),
-                    countries=json.loads(row['countries']),
-                    cqs=json.loads(row['cqs']),
-                    callers=json.loads(row['callers'])
+                    monitor=monitor,
+                    band=band,
+                    messages=row.get('messages', '[]'),
+                    total=int(row.get('total', 0)),
+                    snr=int(row.get('snr', 0)),
+                    countries=counts(row.get('countries', {})),
+                    cqs=counts(row.get('cqs', {})),
+                    callers=counts(row.get('callers', {}))
                 )
                 recs.append(rec)
 
@@ -169,14 +242,7 @@ class Dynamodb_Server(Data_Server):
 
 
     def db_upsert_hour(self, monitor:str, band: str, data: Hours_Record) -> str | None:
-        rec = {
-            'monitor_band': f'{data.monitor}#{data.band}',
-            'ctime': data.ctime,
-            'total': data.total,
-            'snr': data.snr,
-            'countries': json.dumps(data.countries),
-            'cqs': json.dumps(data.cqs)
-        }
+        rec = self.hour_item(data)
         try:
             self.table[self.TB_HOURS].put_item(Item=rec)
         except ClientError as err:
@@ -186,22 +252,23 @@ class Dynamodb_Server(Data_Server):
         else:
             return None
 
-    def db_read_hours(self, monitor:str, band: str, begin: int, end: int) -> List[Hours_Record]:
+    def db_read_hours(self, monitor:str, band: str, begin: int, end: int, fields: List[str] | None = None) -> List[Hours_Record]:
+        """fields: attributes to read, None for all. Attributes not read are left empty in the records."""
         recs: List[Hours_Record] = []
         try:
-            for row in self.table[self.TB_HOURS].query(
-                KeyConditionExpression=Key('monitor_band').eq(f'{monitor}#{band}') & Key('ctime').between(begin, end),
-                Limit=self.RETURN_RECORD_LIMIT
+            for row in self.tb_hours.query(
+                KeyConditionExpression=KEY_MONITOR_BAND.eq(f'{monitor}#{band}') & KEY_CTIME.between(begin, end),
+                Limit=self.RETURN_RECORD_LIMIT,
+                **self.projection(fields)
             )['Items']:
-                mb = row['monitor_band'].split('#')
                 rec = Hours_Record(
                     ctime=int(row['ctime']),
-                    monitor=mb[0],
-                    band=mb[1],
-                    total=int(row['total']),
-                    snr=int(row['snr']),
-                    countries=json.loads(row['countries']),
-                    cqs=json.loads(row['cqs']),
+                    monitor=monitor,
+                    band=band,
+                    total=int(row.get('total', 0)),
+                    snr=int(row.get('snr', 0)),
+                    countries=counts(row.get('countries', {})),
+                    cqs=counts(row.get('cqs', {})),
                 )
                 recs.append(rec)
 
@@ -215,6 +282,12 @@ ROUTE_GET_HOURS = '/hours'
 ROUTE_GET_MINUTES = '/minutes'
 ROUTE_REPORT = '/report'
 
+#attributes a GET may ask for with ?fields=a,b,c
+MINUTES_FIELDS = ('messages', 'total', 'snr', 'countries', 'cqs', 'callers')
+HOURS_FIELDS = ('total', 'snr', 'countries', 'cqs')
+#what /minutes returns without fields, the big messages/callers need ?full=1
+MINUTES_SUMMARY = ['total', 'snr', 'countries', 'cqs']
+
 #init db, check or create tables
 db = Dynamodb_Server()
 
@@ -227,6 +300,19 @@ def errorResp(code, reason):
         'body': reason
     }
 
+def query_fields(query_string, allowed, default):
+    """Attributes asked by ?fields=a,b or ?full=1(all, returned as None), raise ValueError for unknown ones."""
+    if query_string.get('full') == '1':
+        return None
+    fields = query_string.get('fields')
+    if fields is None:
+        return default
+    fields = [f for f in fields.split(',') if f]
+    for f in fields:
+        if f not in allowed:
+            raise ValueError(f'unknown field {f}')
+    return fields
+
 def dataResp(strData):
     return {
         'statusCode': 200,
@@ -259,33 +345,13 @@ def lambda_handler(event, context): #pylint: disable=W0613
 
         body = event.get('body')
         try:
-            band_data = []
-            for m in json.loads(body):
-                band_data.append(Monitor_Message(
-                        gtime=m['time'],
-                        raw=m['raw_message'],
-                        snr=m['snr'],
-                        dt=m['delta_t'],
-                        df=m['delta_f'],
-                        lf=m['lf'],
-                        mtype=m['mtype'],
-                        caller=m['caller'],
-                        country=m['country'],
-                        cq=m['zone_cq'],
-                        itu=m['zone_itu'],
-                        continent=m['continent'],
-                        lat=m['lat'],
-                        lon=m['lon'],
-                        gmtoff=m['gmtoff'],
-                        grid=m['grid'],
-                        peer=m['peer']
-                    ))
+            band_data = report_messages(body)
             r = db.save_monitor_data(monitor=monitor, band=band, data=band_data)
             if r is not None:
                 return errorResp(502, f'Error when save data: {r}')
             else:
                 return dataResp('"success"')
-        except (json.decoder.JSONDecodeError, TypeError, ValueError) as err:
+        except (json.decoder.JSONDecodeError, TypeError, ValueError, KeyError) as err:
             return errorResp(400, f'Error when decode body: {err}')
 
     elif rawPath == ROUTE_GET_MINUTES:
@@ -299,7 +365,8 @@ def lambda_handler(event, context): #pylint: disable=W0613
             end = int(query_string.get('end'))
             if monitor is None or len(monitor) == 0 or band is None or len(band) == 0:
                 return errorResp(400, 'Bad Request with wrong query params')
-            return dataResp(json.dumps(db.db_read_minutes(monitor=monitor, band=band, begin=begin, end=end), cls=Minutes_Record_Encoder))
+            fields = query_fields(query_string, MINUTES_FIELDS, MINUTES_SUMMARY)
+            return dataResp(records_json(db.db_read_minutes(monitor=monitor, band=band, begin=begin, end=end, fields=fields)))
         except (TypeError, ValueError) as err:
             return errorResp(400, f'Error when parse params: {err}')
 
@@ -314,7 +381,8 @@ def lambda_handler(event, context): #pylint: disable=W0613
             end = int(query_string.get('end'))
             if monitor is None or len(monitor) == 0 or band is None or len(band) == 0:
                 return errorResp(400, 'Bad Request with wrong query params')
-            return dataResp(json.dumps(db.db_read_hours(monitor=monitor, band=band, begin=begin, end=end), cls=Hours_Record_Encoder))
+            fields = query_fields(query_string, HOURS_FIELDS, None)
+            return dataResp(records_json(db.db_read_hours(monitor=monitor, band=band, begin=begin, end=end, fields=fields)))
         except (TypeError, ValueError) as err:
             return errorResp(400, f'Error when parse params: {err}')
     else:
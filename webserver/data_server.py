@@ -1,9 +1,11 @@
 from typing import List, Dict
 import json
 import time
-from dataclasses import dataclass, field, asdict
+from collections import Counter
+from operator import itemgetter
+from dataclasses import dataclass, field
 
-@dataclass()
+@dataclass(slots=True)
 class Monitor_Message():
     gtime: int = 0                  #epoch time in second when monitor got this msg
     raw: str = ''                   #raw msg string before decode
@@ -23,7 +25,14 @@ class Monitor_Message():
     grid: str | None = None         #sender 4-character grid
     peer: str | None = None         #callsign of the receiver
 
-@dataclass()
+    def to_dict(self) -> dict:
+        """Fields as a plain dict, what asdict() returns without its recursive deep copy."""
+        return {'gtime': self.gtime, 'raw': self.raw, 'snr': self.snr, 'dt': self.dt, 'df': self.df, 'lf': self.lf,
+                'mtype': self.mtype, 'caller': self.caller, 'country': self.country, 'cq': self.cq, 'itu': self.itu,
+                'continent': self.continent, 'lat': self.lat, 'lon': self.lon, 'gmtoff': self.gmtoff,
+                'grid': self.grid, 'peer': self.peer}
+
+@dataclass(slots=True)
 class Minutes_Record():
     ctime: int = 0                          #epoch time in second when monitor got whose messages, but round to minute
     monitor: str  = 'ft8mon'                #monitor station id
@@ -35,7 +44,12 @@ class Minutes_Record():
     cqs: Dict[str, int] = field(default_factory=Dict[str, int])               #key for cq zone, value for how many messages sent from this cq zone
     callers: Dict[str, int] = field(default_factory=Dict[str, int])            #key for sender callsign, value for how many messages sent from this callsign
 
-@dataclass()
+    def to_dict(self) -> dict:
+        """Fields as a plain dict, the counter dicts are shared not copied."""
+        return {'ctime': self.ctime, 'monitor': self.monitor, 'band': self.band, 'messages': self.messages,
+                'total': self.total, 'snr': self.snr, 'countries': self.countries, 'cqs': self.cqs, 'callers': self.callers}
+
+@dataclass(slots=True)
 class Hours_Record():
     ctime: int = 0                          #epoch time in second when monitor got whose messages, but round to hour.
     monitor: str  = 'ft8mon'                #monitor station id
@@ -45,26 +59,28 @@ class Hours_Record():
     countries: Dict[str, int] = field(default_factory=Dict[str, int])          #key for country name(Annobon Island, China...), value for how many messages sent from this country(by sender callsign)
     cqs: Dict[str, int] = field(default_factory=Dict[str, int])                #key for cq zone, value for how many messages sent from this cq zone
 
-class Monitor_Message_Encoder(json.JSONEncoder):
-    def default(self, o):
-        if isinstance(o, Monitor_Message):
-            return asdict(o)
-        else:
-            return super().default(o)
-
-class Minutes_Record_Encoder(json.JSONEncoder):
-    def default(self, o):
-        if isinstance(o, Minutes_Record):
-            return asdict(o)
-        else:
-            return super().default(o)
-
-class Hours_Record_Encoder(json.JSONEncoder):
-    def default(self, o):
-        if isinstance(o, Hours_Record):
-            return asdict(o)
-        else:
-            return super().default(o)
+    def to_dict(self) -> dict:
+        """Fields as a plain dict, the counter dicts are shared not copied."""
+        return {'ctime': self.ctime, 'monitor': self.monitor, 'band': self.band,
+                'total': self.total, 'snr': self.snr, 'countries': self.countries, 'cqs': self.cqs}
+
+#one preconfigured compact encoder, the records are handed to it as their to_dict() dicts,
+#so json's C encoder never has to call back into a default() per record.
+json_encode = json.JSONEncoder(separators=(',', ':')).encode
+
+def records_json(recs) -> str:
+    """JSON array of Monitor_Message, Minutes_Record or Hours_Record."""
+    return json_encode([r.to_dict() for r in recs])
+
+#keys of a monitor report message, in the order of Monitor_Message fields
+_REPORT_VALUES = itemgetter('time', 'raw_message', 'snr', 'delta_t', 'delta_f', 'lf', 'mtype', 'caller',
+                            'country', 'zone_cq', 'zone_itu', 'continent', 'lat', 'lon', 'gmtoff', 'grid', 'peer')
+
+def report_messages(body: str | bytes) -> List[Monitor_Message]:
+    """Monitor_Message of a monitor report body, the JSON array posted by the monitor.
+        Raise json.JSONDecodeError, TypeError or KeyError on a bad body.
+    """
+    return [Monitor_Message(*_REPORT_VALUES(m)) for m in json.loads(body)]
 
 class Data_Server:
     """Base class for messages access. The implementation of the persistence layer should be provided by subclasses.
@@ -95,6 +111,84 @@ class Data_Server:
         """fetch records in db gtime betwin [begin, end]."""
         raise NotImplementedError ("Needs to be define in sub-class")
 
+    def db_upsert_minutes(self, monitor:str, band: str, data: List[Minutes_Record]) -> str | None:
+        """Write several records to db at once, return the first error. Override when the backend can batch writes."""
+        err = None
+        for rec in data:
+            r = self.db_upsert_minute(monitor=monitor, band=band, data=rec)
+            if err is None:
+                err = r
+        return err
+
+    def db_upsert_hours(self, monitor:str, band: str, data: List[Hours_Record]) -> str | None:
+        """Write several records to db at once, return the first error. Override when the backend can batch writes."""
+        err = None
+        for rec in data:
+            r = self.db_upsert_hour(monitor=monitor, band=band, data=rec)
+            if err is None:
+                err = r
+        return err
+
+
+
+    def db_has_minute(self, monitor:str, band: str, ctime: int) -> bool:
+        """Whether a record exists for that minute. Override when the backend can tell cheaper than a fetch."""
+        return len(self.fetch_in_minutes(monitor=monitor, band=band, begin=ctime, end=ctime)) > 0
+
+    def db_has_hour(self, monitor:str, band: str, ctime: int) -> bool:
+        """Whether a record exists for that hour. Override when the backend can tell cheaper than a fetch."""
+        return len(self.fetch_in_hours(monitor=monitor, band=band, begin=ctime, end=ctime)) > 0
+
+    def db_merge_minutes(self, monitor:str, band: str, data: List[Minutes_Record]) -> str | None:
+        """Add records holding only new messages to the stored ones: messages appended, counters summed,
+            snr averaged by total. Records not in db yet are written as they are. Return the first error.
+            Override when the backend can merge in place.
+        """
+        recs: List[Minutes_Record] = []
+        for rec in data:
+            found = self.fetch_in_minutes(monitor=monitor, band=band, begin=rec.ctime, end=rec.ctime)
+            if len(found) == 0:
+                #empty in db, write a new record
+                recs.append(rec)
+                continue
+            #should have ONLY one record for that minute
+            dbrec = found[0]
+            #both are JSON arrays, splice the texts instead of decoding and encoding them again
+            if dbrec.messages == '[]':
+                dbrec.messages = rec.messages
+            elif rec.messages != '[]':
+                dbrec.messages = dbrec.messages[:-1] + ',' + rec.messages[1:]
+            dbrec.snr = round((dbrec.snr * dbrec.total + rec.snr * rec.total)/ (dbrec.total + rec.total))
+            dbrec.total += rec.total
+            dbrec.countries = Counter(dbrec.countries)
+            dbrec.countries.update(rec.countries)
+            dbrec.cqs = Counter(dbrec.cqs)
+            dbrec.cqs.update(rec.cqs)
+            dbrec.callers = Counter(dbrec.callers)
+            dbrec.callers.update(rec.callers)
+            #now we update record in db
+            recs.append(dbrec)
+        return self.db_upsert_minutes(monitor=monitor, band=band, data=recs)
+
+    def db_merge_hours(self, monitor:str, band: str, data: List[Hours_Record]) -> str | None:
+        """Same as db_merge_minutes for hour records."""
+        recs: List[Hours_Record] = []
+        for c in data:
+            found = self.fetch_in_hours(monitor=monitor, band=band, begin=c.ctime, end=c.ctime)
+            if len(found) == 0: #Empty in db, write new one...
+                recs.append(c)
+                continue
+            #record exist in db, update...
+            rec = found[0]
+            rec.snr = round((rec.snr * rec.total + c.snr * c.total)/(rec.total + c.total))
+            rec.total += c.total
+            rec.countries = Counter(rec.countries)
+            rec.countries.update(c.countries)
+            rec.cqs = Counter(rec.cqs)
+            rec.cqs.update(c.cqs)
+            recs.append(rec)
+        return self.db_upsert_hours(monitor=monitor, band=band, data=recs)
+
 
 
     def save_monitor_data(self, monitor:str, band: str, data: List[Monitor_Message]) -> str | None:
@@ -104,39 +198,38 @@ class Data_Server:
         try:
             #do minutes table first...
             minutes = {}
-            m_begin, m_end = 0, 0
+            #messages of a report come in time order, nearly all fall in the bucket of the one before
+            last_mt, d = None, None
             for msg in data:
                 if msg.caller is None:
                     continue
-                mt = msg.gtime - (msg.gtime % 60)
-                m_begin = mt if m_begin == 0 else min(m_begin, mt)
-                m_end = mt if m_end == 0 else max(m_end, mt)
-                d = minutes.get(mt)
-                if d is None:
-                    minutes[mt] = {'messages': [msg], 'total': 1, 'snr': msg.snr, 'countries': {}, 'cqs': {}, 'callers': {}}
-                    minutes[mt]['callers'][msg.caller] = 1
-                    if msg.country is not None:
-                        minutes[mt]['countries'][msg.country] = 1
-                    if msg.cq is not None:
-                        minutes[mt]['cqs'][msg.cq] = 1
-                else:
-                    d['messages'].append(msg)
-                    d['total'] += 1
-                    d['snr'] += msg.snr
-                    d['callers'][msg.caller] = 1 if d['callers'].get(msg.caller) is None else d['callers'][msg.caller] + 1
-                    if msg.country is not None:
-                        d['countries'][msg.country] = 1 if d['countries'].get(msg.country) is None else d['countries'][msg.country] + 1
-                    if msg.cq is not None:
-                        d['cqs'][msg.cq] = 1 if d['cqs'].get(msg.cq) is None else d['cqs'][msg.cq] + 1
+                gtime = msg.gtime
+                mt = gtime - gtime % 60
+                if mt != last_mt:
+                    d = minutes.get(mt)
+                    if d is None:
+                        d = minutes[mt] = {'messages': [], 'snr': 0, 'countries': [], 'cqs': [], 'callers': []}
+                    last_mt = mt
+                d['messages'].append(msg)
+                d['snr'] += msg.snr
+                d['callers'].append(msg.caller)
+                if msg.country is not None:
+                    d['countries'].append(msg.country)
+                if msg.cq is not None:
+                    d['cqs'].append(msg.cq)
+            #count each field at once, Counter() counts a list in C
+            for d in minutes.values():
+                d['total'] = len(d['messages'])
+                d['countries'] = Counter(d['countries'])
+                d['cqs'] = Counter(d['cqs'])
+                d['callers'] = Counter(d['callers'])
 
             if len(minutes.keys()) == 0:
                 current_time = int(time.time())
                 m_begin = current_time - current_time % 60
-                m_end = m_begin
-                recs = self.fetch_in_minutes(monitor=monitor, band=band, begin=m_begin, end=m_end)
-                if len(recs) == 0:
+                if not self.db_has_minute(monitor=monitor, band=band, ctime=m_begin):
                     #empty in db, write a idle record(no data yet station alive) for that station & band
-                    self.db_upsert_minute(monitor=monitor, band=band, data=Minutes_Record(ctime=m_begin,
+                    self.db_upsert_minutes(monitor=monitor, band=band, data=[Minutes_Record(ctime=m_begin,
                         monitor=monitor,
                         band=band,
                         messages='[]',
@@ -145,75 +238,50 @@ class Data_Server:
                         countries={},
                         cqs={},
                         callers={}
-                        ))
+                        )])
             else:
+                minute_recs: List[Minutes_Record] = []
                 for mt, r in minutes.items():
                     r['snr'] = round(r['snr'] / r['total'])
-                    recs = self.fetch_in_minutes(monitor=monitor, band=band, begin=mt, end=mt)
-                    if len(recs) == 0:
-                        #empty in db, write a new record
-                        self.db_upsert_minute(monitor=monitor, band=band, data=Minutes_Record(
-                            ctime=mt,
-                            monitor=monitor,
-                            band=band,
-                            messages=json.dumps(r['messages'], cls=Monitor_Message_Encoder),
-                            total=r['total'],
-                            snr=r['snr'],
-                            countries=r['countries'],
-                            cqs=r['cqs'],
-                            callers=r['callers']
-                            ))
-                    else:
-                        #should have ONLY one record for that minute
-                        dbrec = recs[0]
-                        dmj = json.loads(dbrec.messages)
-                        dmm: List[Monitor_Message] = []
-                        for m in dmj:
-                            dmm.append(Monitor_Message(**m))
-                        dmm.extend(r['messages'])
-                        dbrec.messages = json.dumps(dmm, cls=Monitor_Message_Encoder)
-                        dbrec.snr = round((dbrec.snr * dbrec.total + r['snr'] * r['total'])/ (dbrec.total + r['total']))
-                        dbrec.total += r['total']
-                        for country, n in r['countries'].items():
-                            dbrec.countries[country] = n if dbrec.countries.get(country) is None else dbrec.countries[country] + n
-                        for cq, n in r['cqs'].items():
-                            dbrec.cqs[cq] = n if dbrec.cqs.get(cq) is None else dbrec.cqs[cq] + n
-                        for cs, n in r['callers'].items():
-                            dbrec.callers[cs] = n if dbrec.callers.get(cs) is None else dbrec.callers[cs]  + n
-                        #now we update record in db
-                        self.db_upsert_minute(monitor=monitor, band=band, data=dbrec)
-
-            #then hours table...
-            m_begin = m_begin - m_begin % 3600
-            m_end = m_begin
-            recs = self.fetch_in_hours(monitor=monitor, band=band, begin=m_begin, end=m_end)
-            hr_db: Dict[int, Hours_Record] = {}
+                    minute_recs.append(Minutes_Record(
+                        ctime=mt,
+                        monitor=monitor,
+                        band=band,
+                        messages=records_json(r['messages']),
+                        total=r['total'],
+                        snr=r['snr'],
+                        countries=r['countries'],
+                        cqs=r['cqs'],
+                        callers=r['callers']
+                        ))
+                self.db_merge_minutes(monitor=monitor, band=band, data=minute_recs)
+
+            #then hours table, folded from the few minute buckets rather than per message again...
             hr_nm: Dict[int, Hours_Record] = {}
-            for r in recs:
-                hr_db[r.ctime] = r
             for mt, r in minutes.items():
                 r_hour = mt - mt % 3600
-                if hr_nm.get(r_hour) is None:
-                    hr_nm[r_hour] = Hours_Record(
+                hr = hr_nm.get(r_hour)
+                if hr is None:
+                    hr = hr_nm[r_hour] = Hours_Record(
                         ctime=r_hour,
                         monitor=monitor,
                         band=band,
                         total=0,
                         snr=0,
-                        countries={},
-                        cqs={}
+                        countries=Counter(),
+                        cqs=Counter()
                     )
-                hr_nm[r_hour].total += r['total']
-                hr_nm[r_hour].snr = round((hr_nm[r_hour].snr * hr_nm[r_hour].total + r['snr'] * r['total'])/(hr_nm[r_hour].total + r['total']))
-                for cn, t in r['countries'].items():
-                    hr_nm[r_hour].countries[cn] = t if hr_nm[r_hour].countries.get(cn) is None else hr_nm[r_hour].countries[cn] + t
-                for cn, t in r['cqs'].items():
-                    hr_nm[r_hour].cqs[cn] = t if hr_nm[r_hour].cqs.get(cn) is None else hr_nm[r_hour].cqs[cn] + t
+                hr.total += r['total']
+                hr.snr = round((hr.snr * hr.total + r['snr'] * r['total'])/(hr.total + r['total']))
+                hr.countries.update(r['countries'])
+                hr.cqs.update(r['cqs'])
 
             if len(hr_nm.keys()) == 0:
-                if len(hr_db.keys()) == 0:
+                #no messages, m_begin is the current minute
+                m_begin = m_begin - m_begin % 3600
+                if not self.db_has_hour(monitor=monitor, band=band, ctime=m_begin):
                     #empty in db, write a idle record(no data yet station alive) for that station & band
-                    self.db_upsert_hour(monitor=monitor, band=band, data=Hours_Record(
+                    self.db_upsert_hours(monitor=monitor, band=band, data=[Hours_Record(
                         ctime=m_begin,
                         monitor=monitor,
                         band=band,
@@ -221,20 +289,9 @@ class Data_Server:
                         snr=0,
                         countries={},
                         cqs={}
-                        ))
+                        )])
             else:
-                for r_hour, c in hr_nm.items():
-                    if hr_db.get(r_hour) is None: #Empty in db, write new one...
-                        self.db_upsert_hour(monitor=monitor, band=band, data=c)
-                    else: #record exist in db, update...
-                        rec = hr_db[r_hour]
-                        rec.snr = round((rec.snr * rec.total + c.snr * c.total)/(rec.total + c.total))
-                        rec.total += c.total
-                        for cn, t in c.countries.items():
-                            rec.countries[cn] = t if rec.countries.get(cn) is None else rec.countries[cn] + t
-                        for cn, t in c.cqs.items():
-                            rec.cqs[cn] = t if rec.cqs.get(cn) is None else rec.cqs[cn] + t
-                        self.db_upsert_hour(monitor=monitor, band=band, data=rec)
+                self.db_merge_hours(monitor=monitor, band=band, data=list(hr_nm.values()))
 
         except Exception as err: #pylint: disable=W0718
             #raise err #debug
@@ -6,24 +6,40 @@ import sys
 import sqlite3
 import json
 import getopt
-from typing import List
-from http.server import BaseHTTPRequestHandler, HTTPServer
+import threading
+from queue import SimpleQueue, Empty
+from functools import wraps
+from typing import List, Dict, Tuple
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from urllib.parse import urlparse, parse_qs
-from data_server import Data_Server, Monitor_Message, Minutes_Record, Hours_Record, Minutes_Record_Encoder, Hours_Record_Encoder
+from data_server import Data_Server, Monitor_Message, Minutes_Record, Hours_Record, report_messages
+
+
+def counts_add(stored: str, new: str) -> str:
+    """Sum two JSON counter objects, keys of stored first."""
+    counts = json.loads(stored)
+    for k, n in json.loads(new).items():
+        counts[k] = n if counts.get(k) is None else counts[k] + n
+    return json.dumps(counts)
+
+
+def locked(method):
+    """Run the method holding the server's lock, the shared connection is used by one thread at a time."""
+    @wraps(method)
+    def call(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return call
 
 
 class Sqlite_Server(Data_Server):
     TB_MINUTES = 'ft8mon_minutes'
     TB_HOURS = 'ft8mon_hours'
     RETURN_RECORD_LIMIT = 100
-
-    def __init__(self, dbconn: sqlite3.Connection) -> None:
-        super().__init__()
-        self.dbconn = dbconn
-        #check tables exist...
-        for row in dbconn.execute(f"SELECT count(name) FROM sqlite_master WHERE type='table' AND name='{self.TB_MINUTES}'"):
-            if row[0] != 1:
-                dbconn.execute(f"""CREATE TABLE {self.TB_MINUTES} (
+    #statements cached per connection, a few per table are in use
+    CACHED_STATEMENTS = 256
+    MINUTES_COLUMNS = """
                     ctime int NOT NULL,
                     monitor varchar(255) NOT NULL,
                     band varchar(32) NOT NULL,
@@ -33,12 +49,9 @@ class Sqlite_Server(Data_Server):
                     countries varchar(1000) NOT NULL,
                     cqs varchar(1000) NOT NULL,
                     callers varchar(1000) NOT NULL,
-                    PRIMARY KEY (ctime)
-                )""")
-                dbconn.commit()
-        for row in dbconn.execute(f"SELECT count(name) FROM sqlite_master WHERE type='table' AND name='{self.TB_HOURS}'"):
-            if row[0] != 1:
-                dbconn.execute(f"""CREATE TABLE {self.TB_HOURS} (
+                    PRIMARY KEY (ctime, monitor, band)
+                """
+    HOURS_COLUMNS = """
                     ctime int NOT NULL,
                     monitor varchar(255) NOT NULL,
                     band varchar(32) NOT NULL,
@@ -46,12 +59,171 @@ class Sqlite_Server(Data_Server):
                     snr int NOT NULL,
                     countries varchar(1000) NOT NULL,
                     cqs varchar(1000) NOT NULL,
-                    PRIMARY KEY (ctime)
-                )""")
-                dbconn.commit()
+                    PRIMARY KEY (ctime, monitor, band)
+                """
 
-    def db_upsert_minute(self, monitor:str, band: str, data: Minutes_Record) -> str | None:
-        rec = {
+    def __init__(self, dbconn: sqlite3.Connection, dbfile: str | None = None) -> None:
+        """dbconn may be shared by threads(check_same_thread=False), all its use is serialized by self.lock.
+            With dbfile given, the GET api reads through pooled read-only connections instead, see reader(),
+            which in WAL mode never waits for the writer.
+        """
+        super().__init__()
+        self.dbconn = dbconn
+        self.lock = threading.RLock()
+        self.dbfile = None if dbfile == ':memory:' else dbfile
+        #idle read-only connections, every request runs on a new thread so they are pooled, not per thread
+        self.readers = SimpleQueue()
+        #write-through: newest ctime known to be stored per (monitor, band). Rows are never deleted,
+        #so a hit stays true, and an idle station's reports skip the existence SELECTs.
+        self.last_minute: Dict[Tuple[str, str], int] = {}
+        self.last_hour: Dict[Tuple[str, str], int] = {}
+        #WAL: a commit appends to the log instead of syncing the db file, readers don't wait for writers.
+        #synchronous=NORMAL only syncs at checkpoints, still safe with WAL.
+        dbconn.execute('PRAGMA journal_mode=WAL')
+        dbconn.execute('PRAGMA synchronous=NORMAL')
+        dbconn.execute('PRAGMA temp_store=MEMORY')
+        dbconn.execute('PRAGMA mmap_size=268435456')
+        dbconn.execute('PRAGMA cache_size=-65536')
+        #transactions are explicit, see transaction()
+        dbconn.isolation_level = None
+        #one statement inserts or updates a record, sqlite >= 3.24
+        self.upsert_minute_sql = f"""INSERT INTO {self.TB_MINUTES} VALUES(:ctime, :monitor, :band, :messages, :total, :snr, :countries, :cqs, :callers)
+                                    ON CONFLICT(ctime, monitor, band) DO UPDATE
+                                    SET
+                                    messages=excluded.messages,
+                                    total=excluded.total,
+                                    snr=excluded.snr,
+                                    countries=excluded.countries,
+                                    cqs=excluded.cqs,
+                                    callers=excluded.callers
+                                    """
+        self.upsert_hour_sql = f"""INSERT INTO {self.TB_HOURS} VALUES(:ctime, :monitor, :band, :total, :snr, :countries, :cqs)
+                                    ON CONFLICT(ctime, monitor, band) DO UPDATE
+                                    SET
+                                    total=excluded.total, snr=excluded.snr, countries=excluded.countries, cqs=excluded.cqs
+                                    """
+        #merge new records into the stored ones in place, see db_merge_minutes().
+        #python's round() keeps the averages identical to the generic merge, sqlite rounds half away from zero.
+        dbconn.create_function('ft8_round', 1, round, deterministic=True)
+        dbconn.create_function('ft8_counts_add', 2, counts_add, deterministic=True)
+        self.merge_minute_sql = f"""INSERT INTO {self.TB_MINUTES} VALUES(:ctime, :monitor, :band, :messages, :total, :snr, :countries, :cqs, :callers)
+                                    ON CONFLICT(ctime, monitor, band) DO UPDATE
+                                    SET
+                                    messages=CASE WHEN messages='[]' THEN excluded.messages
+                                        WHEN excluded.messages='[]' THEN messages
+                                        ELSE substr(messages, 1, length(messages) - 1) || ',' || substr(excluded.messages, 2) END,
+                                    snr=ft8_round((snr * total + excluded.snr * excluded.total) * 1.0 / (total + excluded.total)),
+                                    total=total + excluded.total,
+                                    countries=ft8_counts_add(countries, excluded.countries),
+                                    cqs=ft8_counts_add(cqs, excluded.cqs),
+                                    callers=ft8_counts_add(callers, excluded.callers)
+                                    """
+        self.merge_hour_sql = f"""INSERT INTO {self.TB_HOURS} VALUES(:ctime, :monitor, :band, :total, :snr, :countries, :cqs)
+                                    ON CONFLICT(ctime, monitor, band) DO UPDATE
+                                    SET
+                                    snr=ft8_round((snr * total + excluded.snr * excluded.total) * 1.0 / (total + excluded.total)),
+                                    total=total + excluded.total,
+                                    countries=ft8_counts_add(countries, excluded.countries),
+                                    cqs=ft8_counts_add(cqs, excluded.cqs)
+                                    """
+        #the other statements of the hot paths are built once too, the same text each call
+        #is what the connection's statement cache(cached_statements) is keyed by
+        self.has_minute_sql = f"SELECT 1 FROM {self.TB_MINUTES} WHERE ctime=:ctime AND monitor=:monitor AND band=:band"
+        self.has_hour_sql = f"SELECT 1 FROM {self.TB_HOURS} WHERE ctime=:ctime AND monitor=:monitor AND band=:band"
+        self.read_minutes_sql = f"SELECT * FROM {self.TB_MINUTES} WHERE ctime>=:begin AND ctime<=:end AND monitor=:monitor AND band=:band LIMIT {self.RETURN_RECORD_LIMIT}"
+        self.read_hours_sql = f"SELECT * FROM {self.TB_HOURS} WHERE ctime>=:begin AND ctime<=:end AND monitor=:monitor AND band=:band LIMIT {self.RETURN_RECORD_LIMIT}"
+        self.read_minutes_json_sql = f"""SELECT json_object('ctime', ctime, 'monitor', monitor, 'band', band,
+                                    'messages', messages, 'total', total, 'snr', snr,
+                                    'countries', json(countries), 'cqs', json(cqs), 'callers', json(callers))
+                                    FROM {self.TB_MINUTES} WHERE ctime>=:begin AND ctime<=:end AND monitor=:monitor AND band=:band LIMIT {self.RETURN_RECORD_LIMIT}"""
+        self.read_hours_json_sql = f"""SELECT json_object('ctime', ctime, 'monitor', monitor, 'band', band,
+                                    'total', total, 'snr', snr, 'countries', json(countries), 'cqs', json(cqs))
+                                    FROM {self.TB_HOURS} WHERE ctime>=:begin AND ctime<=:end AND monitor=:monitor AND band=:band LIMIT {self.RETURN_RECORD_LIMIT}"""
+        for table, columns in ((self.TB_MINUTES, self.MINUTES_COLUMNS), (self.TB_HOURS, self.HOURS_COLUMNS)):
+            self.create_table(table, columns)
+            #reads filter one station and band over a ctime range
+            dbconn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_mbc ON {table}(monitor, band, ctime)")
+
+    def create_table(self, table: str, columns: str) -> None:
+        """Create table if missing. Tables of older versions keyed by ctime alone, which let only one
+            monitor/band have a record per minute, are rebuilt with the (ctime, monitor, band) key.
+        """
+        pk = [r['name'] for r in sorted(self.dbconn.execute(f"PRAGMA table_info({table})"), key=lambda r: r['pk']) if r['pk'] > 0]
+        if pk == ['ctime', 'monitor', 'band']:
+            return
+        with self.transaction():
+            if len(pk) == 0:
+                self.dbconn.execute(f"CREATE TABLE {table} ({columns})")
+                return
+            self.dbconn.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+            self.dbconn.execute(f"CREATE TABLE {table} ({columns})")
+            self.dbconn.execute(f"INSERT INTO {table} SELECT * FROM {table}_old")
+            self.dbconn.execute(f"DROP TABLE {table}_old")
+
+    @contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT around the block, ROLLBACK if it raises.
+            Nested uses join the outer transaction, so save_monitor_data commits once.
+        """
+        if self.dbconn.in_transaction:
+            yield
+            return
+        self.dbconn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self.dbconn.execute('ROLLBACK')
+            #writes of the block are gone, so may be what was remembered
+            self.last_minute.clear()
+            self.last_hour.clear()
+            raise
+        self.dbconn.execute('COMMIT')
+
+    @locked
+    def save_monitor_data(self, monitor:str, band: str, data: List[Monitor_Message]) -> str | None:
+        """All reads and writes of one report in a single write transaction."""
+        try:
+            with self.transaction():
+                return super().save_monitor_data(monitor=monitor, band=band, data=data)
+        except sqlite3.Error as err:
+            return f'sqlite err: {err}'
+
+    @staticmethod
+    def remember(last: Dict[Tuple[str, str], int], recs) -> None:
+        for r in recs:
+            key = (r.monitor, r.band)
+            if last.get(key, -1) < r.ctime:
+                last[key] = r.ctime
+
+    @locked
+    def db_has_minute(self, monitor:str, band: str, ctime: int) -> bool:
+        if self.last_minute.get((monitor, band)) == ctime:
+            return True
+        try:
+            found = self.dbconn.execute(self.has_minute_sql,
+                                        {'ctime': ctime, 'monitor': monitor, 'band': band}).fetchone() is not None
+        except sqlite3.Error:
+            return False
+        if found:
+            self.last_minute[(monitor, band)] = max(ctime, self.last_minute.get((monitor, band), -1))
+        return found
+
+    @locked
+    def db_has_hour(self, monitor:str, band: str, ctime: int) -> bool:
+        if self.last_hour.get((monitor, band)) == ctime:
+            return True
+        try:
+            found = self.dbconn.execute(self.has_hour_sql,
+                                        {'ctime': ctime, 'monitor': monitor, 'band': band}).fetchone() is not None
+        except sqlite3.Error:
+            return False
+        if found:
+            self.last_hour[(monitor, band)] = max(ctime, self.last_hour.get((monitor, band), -1))
+        return found
+
+    @staticmethod
+    def minute_row(data: Minutes_Record) -> dict:
+        return {
             'ctime': data.ctime,
             'monitor': data.monitor,
             'band': data.band,
@@ -62,29 +234,31 @@ class Sqlite_Server(Data_Server):
             'cqs': json.dumps(data.cqs),
             'callers': json.dumps(data.callers)
         }
+
+    @staticmethod
+    def hour_row(data: Hours_Record) -> dict:
+        return {
+            'ctime': data.ctime,
+            'monitor': data.monitor,
+            'band': data.band,
+            'total': data.total,
+            'snr': data.snr,
+            'countries': json.dumps(data.countries),
+            'cqs': json.dumps(data.cqs)
+        }
+
+    @locked
+    def db_upsert_minute(self, monitor:str, band: str, data: Minutes_Record) -> str | None:
         try:
-            row = self.dbconn.execute(f"SELECT COUNT(*) FROM {self.TB_MINUTES} WHERE ctime=:ctime AND monitor=:monitor AND band=:band", rec).fetchone()
-            if row[0] == 0:
-                self.dbconn.execute(f"INSERT INTO {self.TB_MINUTES} VALUES(:ctime, :monitor, :band, :messages, :total, :snr, :countries, :cqs, :callers)", rec)
-            else:
-                self.dbconn.execute(f"""UPDATE {self.TB_MINUTES}
-                                    SET 
-                                    messages=:messages,
-                                    total=:total,
-                                    snr=:snr,
-                                    countries=:countries,
-                                    cqs=:cqs,
-                                    callers=:callers
-                                    WHERE 
-                                    ctime=:ctime AND monitor=:monitor AND band=:band
-                                    """, rec)
-            self.dbconn.commit()
+            self.dbconn.execute(self.upsert_minute_sql, self.minute_row(data))
         except sqlite3.Error as err:
             return f'sqlite err: {err}'
 
+        self.remember(self.last_minute, [data])
         return None
 
 
+    @locked
     def db_read_minutes(self, monitor:str, band: str, begin: int, end: int) -> List[Minutes_Record]:
         recs: List[Minutes_Record] = []
         try:
@@ -94,7 +268,7 @@ class Sqlite_Server(Data_Server):
                 'begin': begin,
                 'end': end
             }
-            for row in self.dbconn.execute(f"SELECT * FROM {self.TB_MINUTES} WHERE ctime>=:begin AND ctime<=:end AND monitor=:monitor AND band=:band LIMIT {self.RETURN_RECORD_LIMIT}", p):
+            for row in self.dbconn.execute(self.read_minutes_sql, p):
                 rec = Minutes_Record(
                     ctime=row['ctime'],
                     monitor=row['monitor'],
@@ -113,33 +287,119 @@ class Sqlite_Server(Data_Server):
         return recs
 
 
+    @locked
     def db_upsert_hour(self, monitor:str, band: str, data: Hours_Record) -> str | None:
-        rec = {
-            'ctime': data.ctime,
-            'monitor': data.monitor,
-            'band': data.band,
-            'total': data.total,
-            'snr': data.snr,
-            'countries': json.dumps(data.countries),
-            'cqs': json.dumps(data.cqs)
-        }
         try:
-            row = self.dbconn.execute(f"SELECT COUNT(*) FROM {self.TB_HOURS} WHERE ctime=:ctime AND monitor=:monitor AND band=:band", rec).fetchone()
-            if row[0] == 0:
-                self.dbconn.execute(f"INSERT INTO {self.TB_HOURS} VALUES(:ctime, :monitor, :band, :total, :snr, :countries, :cqs)", rec)
-            else:
-                self.dbconn.execute(f"""UPDATE {self.TB_HOURS}
-                                    SET 
-                                    total=:total, snr=:snr, countries=:countries, cqs=:cqs
-                                    WHERE 
-                                    ctime=:ctime AND monitor=:monitor AND band=:band
-                                    """, rec)
-            self.dbconn.commit()
+            self.dbconn.execute(self.upsert_hour_sql, self.hour_row(data))
         except sqlite3.Error as err:
             return f'sqlite err: {err}'
 
+        self.remember(self.last_hour, [data])
         return None
 
+    #bulk writes: one statement for all records in one transaction.
+    @locked
+    def db_upsert_minutes(self, monitor:str, band: str, data: List[Minutes_Record]) -> str | None:
+        if len(data) == 0:
+            return None
+        try:
+            with self.transaction():
+                self.dbconn.executemany(self.upsert_minute_sql, [self.minute_row(d) for d in data])
+        except sqlite3.Error as err:
+            return f'sqlite err: {err}'
+
+        self.remember(self.last_minute, data)
+        return None
+
+    @locked
+    def db_upsert_hours(self, monitor:str, band: str, data: List[Hours_Record]) -> str | None:
+        if len(data) == 0:
+            return None
+        try:
+            with self.transaction():
+                self.dbconn.executemany(self.upsert_hour_sql, [self.hour_row(d) for d in data])
+        except sqlite3.Error as err:
+            return f'sqlite err: {err}'
+
+        self.remember(self.last_hour, data)
+        return None
+
+    #merges: the stored messages JSON array is extended by splicing text, it is never parsed
+    @locked
+    def db_merge_minutes(self, monitor:str, band: str, data: List[Minutes_Record]) -> str | None:
+        if len(data) == 0:
+            return None
+        try:
+            with self.transaction():
+                self.dbconn.executemany(self.merge_minute_sql, [self.minute_row(d) for d in data])
+        except sqlite3.Error as err:
+            return f'sqlite err: {err}'
+
+        self.remember(self.last_minute, data)
+        return None
+
+    @locked
+    def db_merge_hours(self, monitor:str, band: str, data: List[Hours_Record]) -> str | None:
+        if len(data) == 0:
+            return None
+        try:
+            with self.transaction():
+                self.dbconn.executemany(self.merge_hour_sql, [self.hour_row(d) for d in data])
+        except sqlite3.Error as err:
+            return f'sqlite err: {err}'
+
+        self.remember(self.last_hour, data)
+        return None
+
+    #the GET api only passes records through: let sqlite build each record's JSON, the counter
+    #columns are already JSON text and are never parsed or encoded again in python
+    @contextmanager
+    def reader(self):
+        """A read-only connection out of the pool, opened if none is idle and put back after the block."""
+        try:
+            conn = self.readers.get_nowait()
+        except Empty:
+            conn = sqlite3.connect(self.dbfile, check_same_thread=False, cached_statements=self.CACHED_STATEMENTS)
+            conn.execute('PRAGMA query_only=ON')
+        try:
+            yield conn
+        finally:
+            self.readers.put(conn)
+
+    def read_texts(self, sql: str, p: dict) -> List[str]:
+        if self.dbfile is None:
+            with self.lock:
+                return [row[0] for row in self.dbconn.execute(sql, p)]
+        with self.reader() as conn:
+            return [row[0] for row in conn.execute(sql, p)]
+
+    def db_read_minutes_json(self, monitor:str, band: str, begin: int, end: int) -> List[str]:
+        """Records of db_read_minutes as JSON object texts."""
+        try:
+            p = {
+                'monitor': monitor,
+                'band': band,
+                'begin': begin,
+                'end': end
+            }
+            return self.read_texts(self.read_minutes_json_sql, p)
+        except sqlite3.Error:
+            return []
+
+    def db_read_hours_json(self, monitor:str, band: str, begin: int, end: int) -> List[str]:
+        """Records of db_read_hours as JSON object texts."""
+        try:
+            p = {
+                'monitor': monitor,
+                'band': band,
+                'begin': begin,
+                'end': end
+            }
+            return self.read_texts(self.read_hours_json_sql, p)
+        except sqlite3.Error:
+            return []
+
+    @locked
     def db_read_hours(self, monitor:str, band: str, begin: int, end: int) -> List[Hours_Record]:
         recs: List[Hours_Record] = []
         try:
@@ -149,7 +409,7 @@ class Sqlite_Server(Data_Server):
                 'begin': begin,
                 'end': end
             }
-            for row in self.dbconn.execute(f"SELECT * FROM {self.TB_HOURS} WHERE ctime>=:begin AND ctime<=:end AND monitor=:monitor AND band=:band LIMIT {self.RETURN_RECORD_LIMIT}", p):
+            for row in self.dbconn.execute(self.read_hours_sql, p):
                 recs.append(Hours_Record(
                     ctime=row['ctime'],
                     monitor=row['monitor'],
@@ -172,6 +432,54 @@ ROUTE_GET_HOURS = '/hours'
 ROUTE_GET_MINUTES = '/minutes'
 ROUTE_REPORT = '/report'
 
+WRITE_CHUNK = 1 << 16 #bytes per socket write of a GET response
+WRITE_BATCH = 50 #reports saved by the writer at most per round
+
+
+class Report_Writer:
+    """Save reports on a writer thread, so a POST doesn't wait for the db.
+        Reports queued while the writer is busy are saved in the next round, those of the
+        same station and band as one, which merges into each stored record once.
+    """
+    def __init__(self, dbserver: Sqlite_Server, max_batch: int = WRITE_BATCH) -> None:
+        self.dbserver = dbserver
+        self.max_batch = max_batch
+        self.queue = SimpleQueue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, monitor: str, band: str, data: List[Monitor_Message]) -> None:
+        self.queue.put((monitor, band, data))
+
+    def close(self) -> None:
+        """Save what is queued and stop the writer."""
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+            while batch[-1] is not None and len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            stop = batch[-1] is None
+            if stop:
+                batch.pop()
+            self.write(batch)
+            if stop:
+                return
+
+    def write(self, batch: List[Tuple[str, str, List[Monitor_Message]]]) -> None:
+        reports: Dict[Tuple[str, str], List[Monitor_Message]] = {}
+        for monitor, band, data in batch:
+            reports.setdefault((monitor, band), []).extend(data)
+        for (monitor, band), data in reports.items():
+            r = self.dbserver.save_monitor_data(monitor=monitor, band=band, data=data)
+            if r is not None:
+                print(f'Server error when save data of {monitor} {band}:\n{r}', file=sys.stderr)
+
 def usage():
     print(f"""Simple web api server for ft8 monitor, use sqlite as database. Apis:
                 http://ip:port{ROUTE_REPORT}?token=xxx&id=xxx                           monitor report api
@@ -186,13 +494,32 @@ def usage():
             -f, --dbfile={DEFAULT_DBFILE}   db file path
             -t, --token={DEFAULT_TOKEN}     monitor api password
         """)
-def MakeContextHTTPRequestHandler(dbserver: Sqlite_Server, token: str):
+def MakeContextHTTPRequestHandler(dbserver: Sqlite_Server, writer: Report_Writer, token: str):
     class ApiHandler(BaseHTTPRequestHandler):
         def __init__(self, *args, **kwargs) -> None:
             self.dbserver = dbserver
+            self.writer = writer
             self.token = token
             super().__init__(*args, **kwargs)
 
+        def write_records(self, recs) -> None:
+            """Stream JSON texts of records as a JSON array, sent in chunks of about WRITE_CHUNK bytes,
+                so the whole response is never held as one str and again as bytes.
+            """
+            chunk = [b'[']
+            size = 1
+            for i, r in enumerate(recs):
+                data = r.encode('utf-8')
+                if i > 0:
+                    chunk.append(b',')
+                chunk.append(data)
+                size += len(data) + 1
+                if size >= WRITE_CHUNK:
+                    self.wfile.write(b''.join(chunk))
+                    chunk, size = [], 0
+            chunk.append(b']')
+            self.wfile.write(b''.join(chunk))
+
         def do_GET(self):
             begin, end, monitor, band = None, None, None, None
             try:
@@ -210,18 +537,18 @@ def MakeContextHTTPRequestHandler(dbserver: Sqlite_Server, token: str):
                 self.wfile.write('Bad request params\n'.encode('utf-8'))
                 return
             if self.path.startswith(ROUTE_GET_MINUTES):
-                recs = self.dbserver.db_read_minutes(monitor=monitor, band=band, begin=begin, end=end)
+                recs = self.dbserver.db_read_minutes_json(monitor=monitor, band=band, begin=begin, end=end)
                 self.send_response(200)
                 self.send_header('Content-type', 'application/json')
                 self.end_headers()
-                self.wfile.write(json.dumps(recs, cls=Minutes_Record_Encoder).encode('utf-8'))
+                self.write_records(recs)
 
             elif self.path.startswith(ROUTE_GET_HOURS):
-                recs = self.dbserver.db_read_hours(monitor=monitor, band=band, begin=begin, end=end)
+                recs = self.dbserver.db_read_hours_json(monitor=monitor, band=band, begin=begin, end=end)
                 self.send_response(200)
                 self.send_header('Content-type', 'application/json')
                 self.end_headers()
-                self.wfile.write(json.dumps(recs, cls=Hours_Record_Encoder).encode('utf-8'))
+                self.write_records(recs)
             else:
                 self.send_response(404)
                 self.end_headers()
@@ -256,41 +583,18 @@ def MakeContextHTTPRequestHandler(dbserver: Sqlite_Server, token: str):
             try:
                 content_length = int(self.headers['Content-Length'])
                 payload = self.rfile.read(content_length)
-                payload = json.loads(payload)
-                for m in payload:
-                    band_data.append(Monitor_Message(
-                        gtime=m['time'],
-                        raw=m['raw_message'],
-                        snr=m['snr'],
-                        dt=m['delta_t'],
-                        df=m['delta_f'],
-                        lf=m['lf'],
-                        mtype=m['mtype'],
-                        caller=m['caller'],
-                        country=m['country'],
-                        cq=m['zone_cq'],
-                        itu=m['zone_itu'],
-                        continent=m['continent'],
-                        lat=m['lat'],
-                        lon=m['lon'],
-                        gmtoff=m['gmtoff'],
-                        grid=m['grid'],
-                        peer=m['peer']
-                    ))
-            except (json.JSONDecodeError, ValueError, TypeError) as err:
+                band_data = report_messages(payload)
+            except (json.JSONDecodeError, ValueError, TypeError, KeyError) as err:
                 self.send_response(400)
                 self.end_headers()
                 self.wfile.write(f'Bad json body:\n{err}'.encode('utf-8'))
-
-            r = self.dbserver.save_monitor_data(monitor=monitor, band=band, data=band_data)
-            if r is not None:
-                self.send_response(502)
-                self.end_headers()
-                self.wfile.write(f'Server error when save data:\n{r}'.encode('utf-8'))
                 return
-            self.send_response(200)
+
+            #saved later by the writer, errors of saving go to its log
+            self.writer.put(monitor=monitor, band=band, data=band_data)
+            self.send_response(202)
             self.end_headers()
-            self.wfile.write('success'.encode('utf-8'))
+            self.wfile.write('accepted'.encode('utf-8'))
 
     return ApiHandler
 
@@ -322,13 +626,16 @@ def main() -> None:
             assert False, "unhandled option!"
 
     try:
-        conn = sqlite3.connect(dbfile)
+        #the handler threads share the writer connection, see Sqlite_Server
+        conn = sqlite3.connect(dbfile, check_same_thread=False, cached_statements=Sqlite_Server.CACHED_STATEMENTS)
         conn.row_factory = sqlite3.Row
-        ds = Sqlite_Server(conn)
-        httpd = HTTPServer((addr, port), MakeContextHTTPRequestHandler(dbserver=ds, token=token))
+        ds = Sqlite_Server(conn, dbfile)
+        writer = Report_Writer(ds)
+        httpd = ThreadingHTTPServer((addr, port), MakeContextHTTPRequestHandler(dbserver=ds, writer=writer, token=token))
         print(f'Starts ft8mon api server at {addr}:{port}')
         httpd.serve_forever()
     except KeyboardInterrupt:
+        writer.close()
         conn.close()
         httpd.server_close()
         print('Stopping ft8mon api server...')